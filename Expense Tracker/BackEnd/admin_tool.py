@@ -0,0 +1,57 @@
+"""
+Grant or revoke access to the /admin endpoints.
+
+    python admin_tool.py grant alice
+    python admin_tool.py revoke alice
+    python admin_tool.py list
+
+Admin rights live in person.is_admin, which the API never lets users change.
+"""
+import argparse
+
+from database import Session, Person, migrate
+
+
+def set_admin(username: str, is_admin: bool):
+    db = Session()
+    try:
+        person = db.query(Person).filter(Person.username == username).first()
+        if person is None:
+            raise SystemExit(f"No user named {username}")
+        person.is_admin = is_admin
+        db.commit()
+    finally:
+        db.close()
+
+
+def list_admins():
+    db = Session()
+    try:
+        return [username for (username,) in db.query(Person.username).filter(Person.is_admin == True).order_by(Person.id)]
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    grant_cmd = sub.add_parser("grant", help="give a user admin rights")
+    grant_cmd.add_argument("username")
+    revoke_cmd = sub.add_parser("revoke", help="take admin rights away")
+    revoke_cmd.add_argument("username")
+    sub.add_parser("list", help="show current admins")
+
+    args = parser.parse_args()
+    migrate()
+
+    if args.command == "list":
+        for username in list_admins():
+            print(username)
+    else:
+        set_admin(args.username, args.command == "grant")
+        print(f"{args.username}: admin {'granted' if args.command == 'grant' else 'revoked'}")
+
+
+if __name__ == "__main__":
+    main()
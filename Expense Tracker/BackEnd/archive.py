@@ -0,0 +1,427 @@
+"""
+Move old expenses and income out of the live tables into per-user, per-year archive files.
+
+    python archive.py --months 24
+
+Each archive file (<ARCHIVE_DIR>/<user id>/<kind>-<year>.jsonl.gz) is a series of gzip members,
+one per archived batch, each holding one JSON line of columns and the batch id. Files are only
+ever appended to; a block only counts once its batch is in archive_batch.
+Daily totals go to archive_rollup so /me/summary and reports don't have to read the files.
+It can run while the API is serving: a row edited during a run is archived on the next pass,
+with its new values.
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import Session
+
+from database import (
+    Session as DBSession, Person, Expense, Income, Category, ArchiveRollup, ArchiveCutoff, ArchiveBatch,
+    session_for_user
+)
+from settings import get_settings
+
+ARCHIVE_BATCH_SIZE = 1000
+# Sorts other than by date merge every matching row in memory, so they stop at this many
+ARCHIVE_SORT_LIMIT = 10000
+
+ARCHIVE_COLUMNS = {
+    "expense": ("id", "item", "cost", "date", "category"),
+    "income": ("id", "amount", "source", "date"),
+}
+ARCHIVE_MODELS = {"expense": Expense, "income": Income}
+AMOUNT_FIELDS = {"expense": "cost", "income": "amount"}
+
+
+def archive_cutoff_for(months: int, now: datetime = None) -> datetime:
+    """First day of the month `months` months ago, so a month is either fully archived or fully live."""
+    now = now or datetime.now()
+    year, month = now.year, now.month - months
+    while month < 1:
+        month += 12
+        year -= 1
+    return datetime(year, month, 1)
+
+
+def _user_dir(owner_id: int) -> str:
+    return os.path.join(get_settings().archive_dir, str(owner_id))
+
+
+def _archive_path(owner_id: int, kind: str, year: int) -> str:
+    return os.path.join(_user_dir(owner_id), f"{kind}-{year}.jsonl.gz")
+
+
+def _append_block(path: str, columns: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as f:
+        f.write(gzip.compress((json.dumps(columns) + "\n").encode("utf-8")))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_blocks(path: str):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except EOFError:
+            # A block cut off mid-append (a backup taken during an archive run); its batch
+            # was never committed in the databases it was backed up with
+            return
+
+
+def get_cutoff(db: Session, owner_id: int):
+    row = db.query(ArchiveCutoff).filter(ArchiveCutoff.owner == owner_id).first()
+    return row.archived_before if row else None
+
+
+def reaches_archive(db: Session, owner_id: int, start: datetime = None):
+    """The user's cutoff if a query starting at `start` needs archived rows, else None."""
+    cutoff = get_cutoff(db, owner_id)
+    if cutoff is None or (start is not None and start >= cutoff):
+        return None
+    return cutoff
+
+
+def read_archived(db: Session, owner_id: int, kind: str, start: datetime = None, end: datetime = None):
+    """Archived rows of one kind as dicts, optionally limited to start <= date <= end."""
+    cutoff = reaches_archive(db, owner_id, start)
+    if cutoff is None:
+        return []
+
+    user_dir = _user_dir(owner_id)
+    if not os.path.isdir(user_dir):
+        return []
+
+    columns = ARCHIVE_COLUMNS[kind]
+    committed = {
+        batch for (batch,) in
+        db.query(ArchiveBatch.batch).filter(ArchiveBatch.owner == owner_id, ArchiveBatch.kind == kind)
+    }
+    rows = []
+    legacy_seen = set()
+    for name in sorted(os.listdir(user_dir)):
+        if not (name.startswith(f"{kind}-") and name.endswith(".jsonl.gz")):
+            continue
+        year = int(name[len(kind) + 1:-len(".jsonl.gz")])
+        if (start and year < start.year) or (end and year > end.year):
+            continue
+        for block in _read_blocks(os.path.join(user_dir, name)):
+            batch = block.get("batch")
+            # Written by a run that crashed before its commit; those rows were archived again later
+            if batch is not None and batch not in committed:
+                continue
+            for values in zip(*(block[c] for c in columns)):
+                if batch is None:
+                    # Blocks from before batch ids: a crashed run re-appended identical rows
+                    if values in legacy_seen:
+                        continue
+                    legacy_seen.add(values)
+                row = dict(zip(columns, values))
+                row["date"] = datetime.fromisoformat(row["date"])
+                rows.append(row)
+
+    return [
+        r for r in rows
+        if r["date"] < cutoff and (start is None or r["date"] >= start) and (end is None or r["date"] <= end)
+    ]
+
+
+def max_archived_id(kind: str, owner_id: int = None) -> int:
+    """Highest id of any archived row of this kind, for one user or all of them."""
+    root = get_settings().archive_dir
+    highest = 0
+    if not os.path.isdir(root):
+        return highest
+    owner_dirs = [str(owner_id)] if owner_id is not None else os.listdir(root)
+    for owner_dir in owner_dirs:
+        path = os.path.join(root, owner_dir)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            if name.startswith(f"{kind}-") and name.endswith(".jsonl.gz"):
+                for block in _read_blocks(os.path.join(path, name)):
+                    highest = max([highest] + block["id"])
+    return highest
+
+
+def archived_total(db: Session, owner_id: int, kind: str, start: datetime, end: datetime) -> float:
+    """Sum of archived amounts in [start, end], from the daily rollups plus the partial first day."""
+    cutoff = reaches_archive(db, owner_id, start)
+    if cutoff is None:
+        return 0.0
+
+    total = (
+        db.query(func.coalesce(func.sum(ArchiveRollup.total), 0))
+        .filter(
+            ArchiveRollup.owner == owner_id,
+            ArchiveRollup.kind == kind,
+            ArchiveRollup.day > start.date(),
+            ArchiveRollup.day <= end.date(),
+        )
+        .scalar()
+        or 0
+    )
+
+    # The first day only partly falls in the range, so it comes from the archive itself
+    first_day_end = min(end, datetime.combine(start.date() + timedelta(days=1), datetime.min.time()) - timedelta(microseconds=1))
+    field = AMOUNT_FIELDS[kind]
+    total += sum(r[field] for r in read_archived(db, owner_id, kind, start, first_day_end))
+    return float(total)
+
+
+def archived_by_category(db: Session, owner_id: int, start: datetime, end: datetime) -> dict:
+    """Archived expense totals per category name for whole days in [start, end)."""
+    if reaches_archive(db, owner_id, start) is None:
+        return {}
+    rows = (
+        db.query(ArchiveRollup.category, func.sum(ArchiveRollup.total))
+        .filter(
+            ArchiveRollup.owner == owner_id,
+            ArchiveRollup.kind == "expense",
+            ArchiveRollup.day >= start.date(),
+            ArchiveRollup.day < end.date(),
+        )
+        .group_by(ArchiveRollup.category)
+        .all()
+    )
+    return {category or "Uncategorized": float(total) for category, total in rows}
+
+
+def expense_record(expense: Expense, category=None) -> dict:
+    return {"id": expense.id, "item": expense.item, "cost": expense.cost, "date": expense.date, "category": category}
+
+
+def income_record(income: Income) -> dict:
+    return {"id": income.id, "amount": income.amount, "source": income.source, "date": income.date}
+
+
+def archived_count(db: Session, owner_id: int, kind: str, start: datetime = None, end: datetime = None) -> int:
+    """Number of archived rows in [start, end], from the daily rollups; only partial boundary days read the files."""
+    if reaches_archive(db, owner_id, start) is None:
+        return 0
+
+    query = db.query(func.coalesce(func.sum(ArchiveRollup.count), 0)).filter(
+        ArchiveRollup.owner == owner_id, ArchiveRollup.kind == kind
+    )
+    partial_days = set()
+    if start is not None:
+        if start.time() == time.min:
+            query = query.filter(ArchiveRollup.day >= start.date())
+        else:
+            query = query.filter(ArchiveRollup.day > start.date())
+            partial_days.add(start.date())
+    if end is not None:
+        if end.time() == time.max:
+            query = query.filter(ArchiveRollup.day <= end.date())
+        else:
+            query = query.filter(ArchiveRollup.day < end.date())
+            partial_days.add(end.date())
+    count = query.scalar() or 0
+
+    if partial_days:
+        count += sum(1 for r in read_archived(db, owner_id, kind, start, end) if r["date"].date() in partial_days)
+    return int(count)
+
+
+def page_with_archive(db: Session, owner_id: int, kind: str, live_query, to_record, cutoff: datetime,
+                      sort: str, offset: int, limit=None, start: datetime = None, end: datetime = None):
+    """
+    Page over live rows and the user's archive together, returning (total, records).
+
+    The total comes from a count and the rollups. With date sorts the live rows newer
+    than the cutoff stay in SQL, and the archive files are only read when the page
+    reaches the old tail (archived rows plus any backdated live rows). Other sorts
+    have to merge everything, and raise ValueError past ARCHIVE_SORT_LIMIT rows.
+
+    live_query should select only the columns the caller returns, plus id and the
+    sort fields; to_record turns its rows into dicts like read_archived's.
+    """
+    model = ARCHIVE_MODELS[kind]
+    field, _, direction = sort.rpartition("_")
+    descending = direction != "asc"
+    if field not in ("date", AMOUNT_FIELDS[kind]):
+        field, descending = "date", True
+
+    def load_tail(query):
+        tail = [to_record(r) for r in query.all()] + read_archived(db, owner_id, kind, start, end)
+        tail.sort(key=lambda r: (r[field], r["id"]), reverse=descending)
+        return tail
+
+    if field != "date":
+        total = live_query.count() + archived_count(db, owner_id, kind, start, end)
+        if total > ARCHIVE_SORT_LIMIT:
+            raise ValueError(f"sorting by {field} reaches {total} transactions, more than {ARCHIVE_SORT_LIMIT}")
+        merged = load_tail(live_query)
+        return total, merged[offset:None if limit is None else offset + limit]
+
+    order = (model.date.desc(), model.id.desc()) if descending else (model.date.asc(), model.id.asc())
+    recent = live_query.filter(model.date >= cutoff).order_by(*order)
+    old = live_query.filter(model.date < cutoff)
+    recent_total = recent.count()
+    tail_total = old.count() + archived_count(db, owner_id, kind, start, end)
+
+    def recent_slice(skip, count):
+        query = recent.offset(skip)
+        if count is not None:
+            query = query.limit(count)
+        return [to_record(r) for r in query.all()]
+
+    def tail_slice(skip, count):
+        return load_tail(old)[skip:None if count is None else skip + count]
+
+    # Newest first: recent rows, then the tail. Oldest first: the other way round.
+    if descending:
+        first_total, first, second = recent_total, recent_slice, tail_slice
+    else:
+        first_total, first, second = tail_total, tail_slice, recent_slice
+
+    records = first(offset, limit) if offset < first_total else []
+    if limit is None or offset + limit > first_total:
+        remaining = None if limit is None else limit - len(records)
+        records += second(max(0, offset - first_total), remaining)
+    return recent_total + tail_total, records
+
+
+def _add_rollups(db: Session, owner_id: int, kind: str, records):
+    field = AMOUNT_FIELDS[kind]
+    totals = defaultdict(lambda: [0.0, 0])
+    for r in records:
+        key = (r["date"].date(), r.get("category"))
+        totals[key][0] += r[field]
+        totals[key][1] += 1
+
+    days = {day for day, _ in totals}
+    existing = {
+        (row.day, row.category): row for row in
+        db.query(ArchiveRollup).filter(
+            ArchiveRollup.owner == owner_id,
+            ArchiveRollup.kind == kind,
+            ArchiveRollup.day.in_(days),
+        ).all()
+    }
+    for (day, category), (total, count) in totals.items():
+        row = existing.get((day, category))
+        if row:
+            row.total += total
+            row.count += count
+        else:
+            db.add(ArchiveRollup(owner=owner_id, kind=kind, day=day, category=category, total=total, count=count))
+
+
+def _set_cutoff(db: Session, owner_id: int, cutoff: datetime):
+    row = db.query(ArchiveCutoff).filter(ArchiveCutoff.owner == owner_id).first()
+    if row:
+        row.archived_before = cutoff
+    else:
+        db.add(ArchiveCutoff(owner=owner_id, archived_before=cutoff))
+    db.commit()
+
+
+def archive_user(db: Session, owner_id: int, cutoff: datetime) -> int:
+    """Archive one user's transactions dated before cutoff. Returns the number of rows moved."""
+    previous = get_cutoff(db, owner_id)
+    # Readers look in the archive for anything older than the cutoff, so publish it first;
+    # rows not moved yet are still found in the live tables.
+    if previous is None or previous < cutoff:
+        _set_cutoff(db, owner_id, cutoff)
+    else:
+        cutoff = previous
+
+    moved = 0
+    for kind, model in ARCHIVE_MODELS.items():
+        columns = ARCHIVE_COLUMNS[kind]
+        while True:
+            rows = (
+                db.query(model)
+                .filter(model.owner == owner_id, model.date < cutoff)
+                .order_by(model.id)
+                .limit(ARCHIVE_BATCH_SIZE)
+                .all()
+            )
+            if not rows:
+                break
+
+            # The API may change rows while this runs. Only rows still at the version read
+            # above leave the live table, before any file is written; the others are read
+            # again on the next pass, with their new values.
+            db.query(model).filter(
+                tuple_(model.id, model.version).in_([(r.id, r.version) for r in rows])
+            ).delete(synchronize_session=False)
+            changed = {row_id for (row_id,) in db.query(model.id).filter(model.id.in_([r.id for r in rows]))}
+            rows = [r for r in rows if r.id not in changed]
+            if not rows:
+                db.commit()
+                continue
+
+            if kind == "expense":
+                category_ids = {r.category_id for r in rows if r.category_id is not None}
+                names = dict(db.query(Category.id, Category.name).filter(Category.id.in_(category_ids)).all())
+                records = [expense_record(r, names.get(r.category_id)) for r in rows]
+            else:
+                records = [income_record(r) for r in rows]
+
+            batch = uuid.uuid4().hex
+            by_year = defaultdict(list)
+            for record in records:
+                by_year[record["date"].year].append(record)
+            for year, year_records in by_year.items():
+                block = {c: [r[c] for r in year_records] for c in columns}
+                block["date"] = [d.isoformat() for d in block["date"]]
+                block["batch"] = batch
+                _append_block(_archive_path(owner_id, kind, year), block)
+
+            # Batch, rollups and the delete commit together, so no row is ever counted twice
+            db.add(ArchiveBatch(owner=owner_id, kind=kind, batch=batch))
+            _add_rollups(db, owner_id, kind, records)
+            db.commit()
+            moved += len(rows)
+
+    return moved
+
+
+def delete_user_archive(owner_id: int):
+    shutil.rmtree(_user_dir(owner_id), ignore_errors=True)
+
+
+def archive_all(months: int):
+    cutoff = archive_cutoff_for(months)
+    directory = DBSession()
+    try:
+        owner_ids = [person_id for (person_id,) in directory.query(Person.id).filter(Person.disabled == False).all()]
+    finally:
+        directory.close()
+
+    for owner_id in owner_ids:
+        db = session_for_user(owner_id)
+        try:
+            moved = archive_user(db, owner_id, cutoff)
+        finally:
+            db.close()
+        if moved:
+            print(f"user {owner_id}: archived {moved} transactions older than {cutoff:%Y-%m-%d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--months", type=int, default=None, help="defaults to ARCHIVE_AFTER_MONTHS")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    months = args.months if args.months is not None else settings.archive_after_months
+    if months < 1:
+        parser.error("set --months or ARCHIVE_AFTER_MONTHS to at least 1")
+
+    archive_all(months)
+
+
+if __name__ == "__main__":
+    main()
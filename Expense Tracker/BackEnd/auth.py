@@ -6,35 +6,33 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
 
-from database import Session as DBSession, Person
-
-# JWT Settings
-SECRET_KEY = "Hello World"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
-REFRESH_TOKEN_EXPIRE_DAYS = 7
+from database import Session as DBSession, Person, shard_count, session_for_user
+from settings import get_settings
 
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 # Token creation
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    settings = get_settings()
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=settings.access_token_expire_minutes))
     to_encode.update({"exp": int(expire.timestamp())})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 
 def create_refresh_token(data: dict) -> str:
-    expires = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    settings = get_settings()
+    expires = datetime.now(timezone.utc) + timedelta(days=settings.refresh_token_expire_days)
     to_encode = data.copy()
     to_encode.update({"exp": int(expires.timestamp()), "type": "refresh"})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 # Token verification
 def verify_token(token: str) -> dict:
+    settings = get_settings()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         if "sub" not in payload:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Token payload invalid",
@@ -47,8 +45,9 @@ def verify_token(token: str) -> dict:
 
 
 def verify_refresh_token(token: str) -> dict:
+    settings = get_settings()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         if payload.get("type") != "refresh":
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                 detail="Invalid refresh token type")
@@ -57,8 +56,8 @@ def verify_refresh_token(token: str) -> dict:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid or expired refresh token")
 
-# Database dependency
-def get_db():
+# Directory database dependency (people and username lookups)
+def get_directory_db():
     db = DBSession()
     try:
         yield db
@@ -66,15 +65,41 @@ def get_db():
         db.close()
 
 # Current user dependency
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Person:
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_directory_db)) -> Person:
     payload = verify_token(token)
     try:
         user_id = int(payload.get("sub"))
     except (TypeError, ValueError):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token subject")
 
-    user = db.query(Person).filter(Person.id == user_id).first()
+    user = db.query(Person).filter(Person.id == user_id, Person.disabled == False).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    return user
\ No newline at end of file
+    return user
+
+# Admin dependency
+def get_admin_user(current_user: Person = Depends(get_current_user)) -> Person:
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+def is_reserved_username(username: str) -> bool:
+    reserved = {name.lower() for name in get_settings().admin_usernames}
+    return username.strip().lower() in reserved
+
+# Database dependency, routed to the current user's shard
+def get_db(
+        current_user: Person = Depends(get_current_user),
+        directory_db: Session = Depends(get_directory_db)
+):
+    if not shard_count():
+        yield directory_db
+        return
+
+    db = session_for_user(current_user.id)
+    try:
+        yield db
+    finally:
+        db.close()
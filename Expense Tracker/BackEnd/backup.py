@@ -0,0 +1,343 @@
+"""
+Online backups of the SQLite database files (the main database and any shards) and of
+the transaction archive (ARCHIVE_DIR), which only exists as files.
+
+    python backup.py backup [--dest backups] [--keep 7]
+    python backup.py verify backups/database-20261019-170000.db.gz
+    python backup.py restore backups/database-20261019-170000.db.gz --target database.db
+    python backup.py restore backups/archive-20261019-170000.tar --target archive
+
+Backups use SQLite's backup API a few pages at a time and pause between steps.
+In WAL mode (the default, see SQLITE_WAL) the copy reads from one pinned snapshot,
+so the API keeps serving writes meanwhile. The archive is copied after the databases,
+so every block their archive_batch rows list is in it. Restore everything with the
+same stamp, with the API stopped.
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.engine import make_url
+
+from archive import _read_blocks
+from database import shard_count, shard_url
+from metrics import latency_between
+from settings import get_settings
+
+SNAPSHOT_SUFFIX = ".db.gz"
+ARCHIVE_SNAPSHOT_NAME = "archive"
+# The archive files are gzipped already
+ARCHIVE_SNAPSHOT_SUFFIX = ".tar"
+
+_backup_lock = threading.Lock()
+_last_report = None
+
+
+def sqlite_path(url: str) -> str:
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or not parsed.database or parsed.database == ":memory:":
+        raise ValueError(f"Online backup only supports SQLite database files, not {parsed.get_backend_name()}")
+    return parsed.database
+
+
+def database_paths():
+    paths = [sqlite_path(get_settings().database_url)]
+    paths += [sqlite_path(shard_url(shard)) for shard in range(shard_count())]
+    return paths
+
+
+def check_online_backup():
+    """Raise ValueError unless the databases can be backed up while the API keeps writing."""
+    database_paths()
+    if not get_settings().sqlite_wal:
+        raise ValueError("Online backups need SQLITE_WAL=true: without WAL a copy either locks writers out "
+                         "or restarts after every write")
+
+
+def _integrity_check(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def backup_file(path: str, dest_dir: str, stamp: str, pages: int, pause: float) -> dict:
+    """Copy one database into a verified, gzipped snapshot while it stays online."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = os.path.join(dest_dir, f".{name}-{stamp}.db.tmp")
+    snapshot = os.path.join(dest_dir, f"{name}-{stamp}{SNAPSHOT_SUFFIX}")
+
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+        # Each step only holds a read lock on the source; sleeping here lets writers in
+        if remaining and pause:
+            time.sleep(pause)
+
+    started = time.perf_counter()
+    source = sqlite3.connect(path, isolation_level=None)
+    target = sqlite3.connect(tmp_path)
+    try:
+        mode = source.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode == "wal":
+            # Pin a read snapshot: writers carry on in the WAL and the copy never has to restart
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=pages, progress=progress)
+            source.execute("COMMIT")
+        else:
+            # Without WAL a pinned read would lock writers out, and any write restarts the
+            # copy. Fine with the API stopped; the endpoint refuses to start without SQLITE_WAL.
+            source.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+        source.close()
+    copy_seconds = time.perf_counter() - started
+
+    try:
+        check = _integrity_check(tmp_path)
+        if check != "ok":
+            raise RuntimeError(f"Snapshot of {path} failed integrity check: {check}")
+
+        with open(tmp_path, "rb") as raw, gzip.open(snapshot + ".part", "wb") as compressed:
+            shutil.copyfileobj(raw, compressed)
+        os.replace(snapshot + ".part", snapshot)
+        size = os.path.getsize(tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        "database": path,
+        "snapshot": snapshot,
+        "journal_mode": mode,
+        "steps": steps,
+        "copy_seconds": round(copy_seconds, 3),
+        "total_seconds": round(time.perf_counter() - started, 3),
+        "size_bytes": size,
+        "compressed_bytes": os.path.getsize(snapshot),
+    }
+
+
+def backup_archive(dest_dir: str, stamp: str) -> dict:
+    """
+    Copy ARCHIVE_DIR into a tar next to the database snapshots. Blocks appended after the
+    databases were copied belong to batches the snapshots don't list, so a restore skips them.
+    """
+    archive_dir = get_settings().archive_dir
+    snapshot = os.path.join(dest_dir, f"{ARCHIVE_SNAPSHOT_NAME}-{stamp}{ARCHIVE_SNAPSHOT_SUFFIX}")
+    started = time.perf_counter()
+    with tarfile.open(snapshot + ".part", "w") as tar:
+        if os.path.isdir(archive_dir):
+            tar.add(archive_dir, arcname=ARCHIVE_SNAPSHOT_NAME)
+        files = len([m for m in tar.getmembers() if m.isfile()])
+    os.replace(snapshot + ".part", snapshot)
+
+    return {
+        "archive_dir": archive_dir,
+        "snapshot": snapshot,
+        "files": files,
+        "total_seconds": round(time.perf_counter() - started, 3),
+        "compressed_bytes": os.path.getsize(snapshot),
+    }
+
+
+def rotate(dest_dir: str, name: str, keep: int, suffix: str = SNAPSHOT_SUFFIX):
+    """Delete all but the newest `keep` snapshots of one database."""
+    snapshots = sorted(
+        f for f in os.listdir(dest_dir)
+        if f.startswith(f"{name}-") and f.endswith(suffix)
+    )
+    for old in snapshots[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(dest_dir, old))
+
+
+def list_snapshots(dest_dir: str = None):
+    dest_dir = dest_dir or get_settings().backup_dir
+    if not os.path.isdir(dest_dir):
+        return []
+    return sorted(f for f in os.listdir(dest_dir) if f.endswith((SNAPSHOT_SUFFIX, ARCHIVE_SNAPSHOT_SUFFIX)))
+
+
+def backup_in_progress() -> bool:
+    return _backup_lock.locked()
+
+
+def last_report():
+    return _last_report
+
+
+def run_backup(dest_dir: str = None, keep: int = None):
+    """Back up every database file. Returns the report, or None if a backup is already running."""
+    global _last_report
+    if not _backup_lock.acquire(blocking=False):
+        return None
+
+    try:
+        settings = get_settings()
+        dest_dir = dest_dir or settings.backup_dir
+        keep = keep if keep is not None else settings.backup_keep
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+        started = time.time()
+        files = []
+        for path in database_paths():
+            files.append(backup_file(path, dest_dir, stamp, settings.backup_step_pages, settings.backup_step_pause))
+            rotate(dest_dir, os.path.splitext(os.path.basename(path))[0], keep)
+        archive = backup_archive(dest_dir, stamp)
+        rotate(dest_dir, ARCHIVE_SNAPSHOT_NAME, keep, ARCHIVE_SNAPSHOT_SUFFIX)
+        finished = time.time()
+
+        duration = finished - started
+        _last_report = {
+            "started_at": datetime.fromtimestamp(started).isoformat(),
+            "duration_seconds": round(duration, 3),
+            "files": files,
+            "archive": archive,
+            # Same-length window right before the backup, as a baseline
+            "latency_before": latency_between(started - duration, started),
+            "latency_during": latency_between(started, finished),
+        }
+        return _last_report
+    finally:
+        _backup_lock.release()
+
+
+def verify_snapshot(snapshot: str) -> dict:
+    """Decompress a snapshot to a temp file and check it is a sound database."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, "verify.db")
+        with gzip.open(snapshot, "rb") as compressed, open(tmp_path, "wb") as raw:
+            shutil.copyfileobj(compressed, raw)
+
+        check = _integrity_check(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            counts = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+        finally:
+            conn.close()
+
+    return {"snapshot": snapshot, "integrity": check, "tables": counts}
+
+
+def restore_snapshot(snapshot: str, target_path: str) -> dict:
+    """Replace target_path's contents with a verified snapshot."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, "restore.db")
+        with gzip.open(snapshot, "rb") as compressed, open(tmp_path, "wb") as raw:
+            shutil.copyfileobj(compressed, raw)
+
+        check = _integrity_check(tmp_path)
+        if check != "ok":
+            raise RuntimeError(f"Refusing to restore {snapshot}: integrity check says {check}")
+
+        source = sqlite3.connect(tmp_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    return {"snapshot": snapshot, "restored_to": target_path}
+
+
+def verify_archive_snapshot(snapshot: str) -> dict:
+    """Read every block of every archive file in the tar."""
+    blocks = {}
+    try:
+        with tarfile.open(snapshot) as tar, tempfile.TemporaryDirectory() as tmp_dir:
+            for member in tar.getmembers():
+                if not member.isfile():
+                    continue
+                path = os.path.join(tmp_dir, "file")
+                with tar.extractfile(member) as packed, open(path, "wb") as raw:
+                    shutil.copyfileobj(packed, raw)
+                blocks[member.name] = sum(1 for _ in _read_blocks(path))
+    except (tarfile.TarError, OSError, ValueError) as e:
+        return {"snapshot": snapshot, "integrity": str(e), "tables": blocks}
+    return {"snapshot": snapshot, "integrity": "ok", "tables": blocks}
+
+
+def restore_archive_snapshot(snapshot: str, target_dir: str) -> dict:
+    """Replace target_dir with the archive directory in the tar."""
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    with tempfile.TemporaryDirectory(dir=parent) as tmp_dir:
+        with tarfile.open(snapshot) as tar:
+            # Only plain files under archive/, whatever the tar says
+            options = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+            tar.extractall(tmp_dir, **options)
+        restored = os.path.join(tmp_dir, ARCHIVE_SNAPSHOT_NAME)
+        os.makedirs(restored, exist_ok=True)
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.replace(restored, target_dir)
+
+    return {"snapshot": snapshot, "restored_to": target_dir}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backup_cmd = sub.add_parser("backup", help="take a snapshot of every database file")
+    backup_cmd.add_argument("--dest", default=None, help="defaults to BACKUP_DIR")
+    backup_cmd.add_argument("--keep", type=int, default=None, help="defaults to BACKUP_KEEP")
+
+    verify_cmd = sub.add_parser("verify", help="integrity-check a snapshot or archive tar")
+    verify_cmd.add_argument("snapshot")
+
+    restore_cmd = sub.add_parser("restore", help="restore a snapshot (stop the API first)")
+    restore_cmd.add_argument("snapshot")
+    restore_cmd.add_argument("--target", required=True, help="database file or archive directory to overwrite")
+
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        if not get_settings().sqlite_wal:
+            print("SQLITE_WAL is off: stop the API first, or writes will keep restarting the copy", file=sys.stderr)
+        report = run_backup(args.dest, args.keep)
+        for f in report["files"]:
+            print(
+                f"{f['database']} -> {f['snapshot']}: {f['size_bytes']} bytes "
+                f"({f['compressed_bytes']} compressed) in {f['total_seconds']}s over {f['steps']} steps"
+            )
+        archive = report["archive"]
+        print(f"{archive['archive_dir']} -> {archive['snapshot']}: {archive['files']} files in {archive['total_seconds']}s")
+        print(f"Backup finished in {report['duration_seconds']}s")
+    elif args.command == "verify":
+        if args.snapshot.endswith(ARCHIVE_SNAPSHOT_SUFFIX):
+            result = verify_archive_snapshot(args.snapshot)
+        else:
+            result = verify_snapshot(args.snapshot)
+        print(f"{result['snapshot']}: integrity {result['integrity']}")
+        unit = "blocks" if args.snapshot.endswith(ARCHIVE_SNAPSHOT_SUFFIX) else "rows"
+        for table, count in sorted(result["tables"].items()):
+            print(f"  {table}: {count} {unit}")
+        if result["integrity"] != "ok":
+            raise SystemExit(1)
+    elif args.snapshot.endswith(ARCHIVE_SNAPSHOT_SUFFIX):
+        result = restore_archive_snapshot(args.snapshot, args.target)
+        print(f"Restored {result['snapshot']} to {result['restored_to']}")
+    else:
+        result = restore_snapshot(args.snapshot, args.target)
+        print(f"Restored {result['snapshot']} to {result['restored_to']}")
+
+
+if __name__ == "__main__":
+    main()
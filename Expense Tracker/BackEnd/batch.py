@@ -0,0 +1,139 @@
+from collections import defaultdict
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from database import Expense, Category, Income
+from schemas import BatchResult
+from changes import next_version, record_deletes
+from sketches import record_batch
+
+MAX_BATCH_OPERATIONS = 5000
+
+EXPENSE_FIELDS = ("item", "cost", "date")
+INCOME_FIELDS = ("amount", "source", "date")
+
+
+def _check_operations(operations, fields):
+    """Reject duplicate ids and operations that would change nothing, before touching the database."""
+    problems = {}
+    seen = set()
+    for index, op in enumerate(operations):
+        if op.id in seen:
+            problems[index] = "id appears more than once in the batch"
+        elif op.op == "update" and not any(getattr(op, f, None) is not None for f in fields + ("category",)):
+            problems[index] = "nothing to update"
+        elif op.op == "recategorize" and not op.category:
+            problems[index] = "category is required"
+        seen.add(op.id)
+    return problems
+
+
+def _owned_ids(db: Session, model, owner_id: int, ids):
+    if not ids:
+        return set()
+    return {
+        row_id for (row_id,) in
+        db.query(model.id).filter(model.owner == owner_id, model.id.in_(ids)).all()
+    }
+
+
+def _category_ids(db: Session, owner_id: int, names, version: int):
+    """Map category names to ids for this user, creating the missing ones."""
+    if not names:
+        return {}
+    categories = {
+        c.name: c.id for c in
+        db.query(Category).filter(Category.owner == owner_id, Category.name.in_(names)).all()
+    }
+    missing = [Category(name=name, owner=owner_id, version=version) for name in names if name not in categories]
+    if missing:
+        db.add_all(missing)
+        db.flush()
+        categories.update({c.name: c.id for c in missing})
+    return categories
+
+
+def _expense_costs(db: Session, ids):
+    """{expense id: (category name, cost)} for the given expenses."""
+    rows = (
+        db.query(Expense.id, Category.name, Expense.cost)
+        .outerjoin(Category, Expense.category_id == Category.id)
+        .filter(Expense.id.in_(ids))
+    )
+    return {expense_id: (name, cost) for expense_id, name, cost in rows}
+
+
+def _expense_costs_after(before, operations, results):
+    after = {}
+    for op, result in zip(operations, results):
+        if result.status != "ok" or op.op == "delete":
+            continue
+        category, cost = before[op.id]
+        after[op.id] = (op.category or category, op.cost if op.op == "update" and op.cost is not None else cost)
+    return after
+
+
+def _apply_batch(db: Session, model, kind: str, owner_id: int, operations, fields, with_categories: bool):
+    problems = _check_operations(operations, fields)
+    candidates = [op.id for index, op in enumerate(operations) if index not in problems]
+    owned = _owned_ids(db, model, owner_id, candidates)
+
+    results = []
+    deletes = []
+    updates = []
+    moves = defaultdict(list)
+    for index, op in enumerate(operations):
+        if index in problems:
+            results.append(BatchResult(id=op.id, op=op.op, status="invalid", detail=problems[index]))
+            continue
+        if op.id not in owned:
+            results.append(BatchResult(id=op.id, op=op.op, status="not_found"))
+            continue
+
+        if op.op == "delete":
+            deletes.append(op.id)
+        else:
+            values = {f: getattr(op, f) for f in fields if op.op == "update" and getattr(op, f) is not None}
+            if values:
+                updates.append({"id": op.id, **values})
+            if with_categories and op.category:
+                moves[op.category].append(op.id)
+        results.append(BatchResult(id=op.id, op=op.op, status="ok"))
+
+    if not (deletes or updates or moves):
+        return {"applied": 0, "results": results}
+
+    try:
+        if model is Expense:
+            # The old costs have to be read before the rows change
+            before = _expense_costs(db, [r.id for r in results if r.status == "ok"])
+            record_batch(db, owner_id, before, _expense_costs_after(before, operations, results))
+
+        version = next_version(db, owner_id)
+        if deletes:
+            db.query(model).filter(model.id.in_(deletes)).delete(synchronize_session=False)
+            record_deletes(db, owner_id, kind, deletes, version)
+        if updates:
+            db.execute(update(model), [{**values, "version": version} for values in updates])
+        if moves:
+            category_ids = _category_ids(db, owner_id, list(moves), version)
+            for name, ids in moves.items():
+                db.query(model).filter(model.id.in_(ids)).update(
+                    {model.category_id: category_ids[name], model.version: version}, synchronize_session=False
+                )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    applied = sum(1 for r in results if r.status == "ok")
+    return {"applied": applied, "results": results}
+
+
+def apply_expense_batch(db: Session, owner_id: int, operations):
+    return _apply_batch(db, Expense, "expense", owner_id, operations, EXPENSE_FIELDS, with_categories=True)
+
+
+def apply_income_batch(db: Session, owner_id: int, operations):
+    return _apply_batch(db, Income, "income", owner_id, operations, INCOME_FIELDS, with_categories=False)
@@ -0,0 +1,67 @@
+"""
+Measure how long a fresh worker process takes to boot.
+
+    python bench_startup.py --runs 10
+
+Each run is a new interpreter against a throwaway SQLite file, timing:
+  import   - `import main` (should not touch the database)
+  create   - create_app()
+  startup  - running the lifespan startup (schema migration)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RUN_ONCE = """
+import asyncio, json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+app = main.create_app()
+t2 = time.perf_counter()
+
+async def start():
+    async with main.lifespan(app):
+        pass
+
+asyncio.run(start())
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "create": t2 - t1, "startup": t3 - t2}))
+"""
+
+
+def run_once(workdir: str, migrate_on_startup: bool) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env["MIGRATE_ON_STARTUP"] = "1" if migrate_on_startup else "0"
+    env["PYTHONPATH"] = BACKEND_DIR
+    out = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", RUN_ONCE],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for label, migrate_on_startup in (("migrate on startup", True), ("migrate skipped", False)):
+            runs = [run_once(workdir, migrate_on_startup) for _ in range(args.runs)]
+            print(f"{label} ({args.runs} runs, median ms)")
+            for phase in ("import", "create", "startup"):
+                print(f"  {phase:<8} {statistics.median(r[phase] for r in runs) * 1000:8.1f}")
+            total = statistics.median(sum(r.values()) for r in runs)
+            print(f"  {'total':<8} {total * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
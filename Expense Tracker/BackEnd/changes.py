@@ -0,0 +1,115 @@
+from collections import defaultdict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Category, Expense, Income, Budget, ChangeCounter, Tombstone
+from archive import get_cutoff
+
+CHANGES_PAGE_SIZE = 1000
+
+
+def next_version(db: Session, owner_id: int) -> int:
+    """
+    Bump and return the user's change version. Everything changed in the same
+    transaction shares this version.
+    """
+    updated = db.query(ChangeCounter).filter(ChangeCounter.owner == owner_id).update(
+        {ChangeCounter.version: ChangeCounter.version + 1}, synchronize_session=False
+    )
+    if not updated:
+        # Rows from before versioning are at version 1, so new changes start above it
+        db.add(ChangeCounter(owner=owner_id, version=2))
+        db.flush()
+    return db.query(ChangeCounter.version).filter(ChangeCounter.owner == owner_id).scalar()
+
+
+def current_version(db: Session, owner_id: int) -> int:
+    version = db.query(ChangeCounter.version).filter(ChangeCounter.owner == owner_id).scalar()
+    return version or 1
+
+
+def record_deletes(db: Session, owner_id: int, kind: str, row_ids, version: int):
+    db.add_all(Tombstone(owner=owner_id, kind=kind, row_id=row_id, version=version) for row_id in row_ids)
+
+
+# Tombstone kinds and the tables their ids belong to
+TOMBSTONE_MODELS = {"category": Category, "expense": Expense, "income": Income, "budget": Budget}
+
+
+def _live_ids(db: Session, owner_id: int, tombstones) -> set:
+    """(kind, id) of tombstones whose id belongs to a live row again, which happens after a shard move."""
+    live = set()
+    for kind, model in TOMBSTONE_MODELS.items():
+        ids = [t.row_id for t in tombstones if t.kind == kind]
+        if ids:
+            live.update((kind, row_id) for (row_id,) in db.query(model.id).filter(model.owner == owner_id, model.id.in_(ids)))
+    return live
+
+
+def _page_end(db: Session, owner_id: int, since: int, until: int, limit: int) -> int:
+    """
+    Last version of a page starting after `since`: about `limit` rows, but never half a
+    version, or a client continuing from it would skip the rest of that version.
+    """
+    counts = defaultdict(int)
+    for model in (Category, Expense, Income, Budget, Tombstone):
+        # Each version has at least one row, so no table needs more than `limit` of them
+        rows = (
+            db.query(model.version, func.count())
+            .filter(model.owner == owner_id, model.version > since, model.version <= until)
+            .group_by(model.version)
+            .order_by(model.version)
+            .limit(limit)
+        )
+        for version, count in rows:
+            counts[version] += count
+
+    total = 0
+    for version in sorted(counts):
+        total += counts[version]
+        if total >= limit:
+            return version
+    return until
+
+
+def get_changes(db: Session, owner_id: int, since: int, limit: int = CHANGES_PAGE_SIZE) -> dict:
+    """
+    Rows changed and deleted after `since`, one page at a time. Clients call again with
+    since=version while has_more is set.
+
+    Only live rows are synced. Archived rows never change and are removed without
+    tombstones, so a mirror keeps what it already has from before archived_before,
+    and a new mirror reads that history from the list endpoints instead.
+    """
+    latest = current_version(db, owner_id)
+    until = _page_end(db, owner_id, since, latest, limit)
+
+    def changed(model):
+        return db.query(model).filter(model.owner == owner_id, model.version > since, model.version <= until)
+
+    categories = changed(Category).all()
+    tombstones = changed(Tombstone).order_by(Tombstone.version).all()
+    live = _live_ids(db, owner_id, tombstones)
+    names = dict(db.query(Category.id, Category.name).filter(Category.owner == owner_id).all())
+
+    return {
+        "version": until,
+        "has_more": until < latest,
+        "archived_before": get_cutoff(db, owner_id),
+        "categories": [{"id": c.id, "name": c.name, "version": c.version} for c in categories],
+        "expenses": [
+            {
+                "id": e.id, "item": e.item, "cost": e.cost, "date": e.date,
+                "category": names.get(e.category_id), "version": e.version,
+            }
+            for e in changed(Expense).all()
+        ],
+        "income": changed(Income).all(),
+        "budgets": changed(Budget).all(),
+        # A row sent in full replaces whatever the client had under that id, so its tombstones are left out
+        "deleted": [
+            {"kind": t.kind, "id": t.row_id, "version": t.version}
+            for t in tombstones if (t.kind, t.row_id) not in live
+        ],
+    }
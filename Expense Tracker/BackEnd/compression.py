@@ -0,0 +1,108 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def _accepted_encodings(header: str) -> dict:
+    """Parse Accept-Encoding into {encoding: quality}."""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(header: str):
+    accepted = _accepted_encodings(header)
+    options = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(options, key=lambda e: accepted.get(e, accepted.get("*", 0)))
+    return best if accepted.get(best, accepted.get("*", 0)) > 0 else None
+
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip for responses above minimum_size, picked from Accept-Encoding.
+
+    Responses here are small JSON documents, so the body is buffered and
+    compressed in one go rather than streamed.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        body = []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            await self._send_response(send, start, b"".join(body), encoding)
+
+        await self.app(scope, receive, send_compressed)
+
+    def _compress(self, data: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level)
+
+    async def _send_response(self, send, start, data: bytes, encoding: str):
+        headers = [(k, v) for k, v in start["headers"]]
+        names = {k.lower() for k, _ in headers}
+        content_type = next((v.decode("latin-1") for k, v in headers if k.lower() == b"content-type"), "")
+
+        if (
+            len(data) >= self.minimum_size
+            and b"content-encoding" not in names
+            and content_type.startswith(COMPRESSIBLE_TYPES)
+        ):
+            data = self._compress(data, encoding)
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(data)).encode("latin-1")),
+            ]
+            if b"vary" in names:
+                headers = [(k, v + b", Accept-Encoding" if k.lower() == b"vary" else v) for k, v in headers]
+            else:
+                headers.append((b"vary", b"Accept-Encoding"))
+
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": data})
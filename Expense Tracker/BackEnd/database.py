@@ -1,8 +1,12 @@
+import threading
 from datetime import datetime
-from sqlalchemy import create_engine, ForeignKey, Column, Integer, String, CHAR, DateTime, Float, UniqueConstraint, Boolean
+from sqlalchemy import create_engine, event, ForeignKey, Column, Integer, String, CHAR, Date, DateTime, Float, UniqueConstraint, Boolean, Index, LargeBinary, inspect, text
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy.schema import CreateTable
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from settings import get_settings
+
 
 # SETUP
 Base = declarative_base()
@@ -11,6 +15,8 @@ Base = declarative_base()
 # Models
 class Person(Base):
     __tablename__ = "person"
+    # A purged account's id may still be in unexpired tokens, so it must never be handed out again
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String, unique=True, nullable=False)
@@ -21,6 +27,9 @@ class Person(Base):
     profile_emoji = Column(String, default="👤")
     password_hash = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.now)
+    disabled = Column(Boolean, default=False, nullable=False)
+    # Only set with admin_tool.py, never through the API
+    is_admin = Column(Boolean, default=False, nullable=False)
 
     expenses = relationship("Expense", back_populates="person_rel")
     income_rel = relationship("Income", back_populates="owner_rel")
@@ -40,16 +49,23 @@ class Category(Base):
     __tablename__ = "category"
     __table_args__ = (
         UniqueConstraint("name", "owner", name="uix_user_category"),
+        Index("ix_category_owner_version", "owner", "version"),
     )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     owner = Column(Integer, ForeignKey("person.id"))
+    version = Column(Integer, nullable=False, default=1)
     expenses = relationship("Expense", back_populates="category_rel")
 
 
 class Expense(Base):
     __tablename__ = "expense"
+    __table_args__ = (
+        Index("ix_expense_owner_version", "owner", "version"),
+        # Archived rows keep their ids, so SQLite must never hand an id out twice
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     item = Column(String, nullable=False)
@@ -57,6 +73,7 @@ class Expense(Base):
     date = Column(DateTime, default=datetime.now)
     owner = Column(Integer, ForeignKey("person.id"))
     category_id = Column(Integer, ForeignKey("category.id"))
+    version = Column(Integer, nullable=False, default=1)
 
     person_rel = relationship("Person", back_populates="expenses")
     category_rel = relationship("Category", back_populates="expenses")
@@ -67,18 +84,26 @@ class Expense(Base):
 
 class Income(Base):
     __tablename__ = "income"
+    __table_args__ = (
+        Index("ix_income_owner_version", "owner", "version"),
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     amount = Column(Float, nullable=False)
     source = Column(String(100), nullable=False)
     date = Column(DateTime, default=datetime.now)
     owner = Column(Integer, ForeignKey("person.id"), nullable=False)
+    version = Column(Integer, nullable=False, default=1)
 
     owner_rel = relationship("Person", back_populates="income_rel")
 
 
 class Budget(Base):
     __tablename__ = "budgets"
+    __table_args__ = (
+        Index("ix_budgets_owner_version", "owner", "version"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     category = Column(String(100), nullable=False)
@@ -87,14 +112,340 @@ class Budget(Base):
     start_date = Column(DateTime, nullable=True)
     end_date = Column(DateTime, nullable=True)
     owner = Column(Integer, ForeignKey("person.id"), nullable=False)
+    version = Column(Integer, nullable=False, default=1)
 
     owner_rel = relationship("Person", back_populates="budget_rel")
 
 
+class AccountPurge(Base):
+    __tablename__ = "account_purge"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Not a foreign key: the person row is the last thing the purge deletes
+    person_id = Column(Integer, unique=True, nullable=False)
+    stage = Column(String(20), nullable=False, default="expense")
+    rows_deleted = Column(Integer, nullable=False, default=0)
+    status = Column(String(20), nullable=False, default="pending")
+    requested_at = Column(DateTime, default=datetime.now)
+    finished_at = Column(DateTime, nullable=True)
+    # Touched after every chunk; a "running" purge that stops touching it died with its worker
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"AccountPurge(person_id={self.person_id}, stage={self.stage}, status={self.status})"
+
+
+# Daily totals of archived transactions, so summaries and reports don't need the archive files
+class ArchiveRollup(Base):
+    __tablename__ = "archive_rollup"
+    __table_args__ = (
+        UniqueConstraint("owner", "kind", "day", "category", name="uix_archive_rollup"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(Integer, ForeignKey("person.id"), nullable=False, index=True)
+    kind = Column(String(10), nullable=False)
+    day = Column(Date, nullable=False)
+    category = Column(String, nullable=True)
+    total = Column(Float, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# Transactions dated before archived_before may live in the user's archive files
+class ArchiveCutoff(Base):
+    __tablename__ = "archive_cutoff"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(Integer, ForeignKey("person.id"), unique=True, nullable=False)
+    archived_before = Column(DateTime, nullable=False)
+
+
+# Archive blocks whose rows have left the live tables. A block whose batch isn't
+# listed was written by an archive run that crashed before committing, and is skipped.
+class ArchiveBatch(Base):
+    __tablename__ = "archive_batch"
+    __table_args__ = (
+        UniqueConstraint("owner", "batch", name="uix_archive_batch"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(Integer, ForeignKey("person.id"), nullable=False)
+    kind = Column(String(10), nullable=False)
+    batch = Column(String(32), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+
+# Per-user change counter behind the version columns and /me/changes
+class ChangeCounter(Base):
+    __tablename__ = "change_counter"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(Integer, ForeignKey("person.id"), unique=True, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+
+
+# Deleted rows, so clients syncing with /me/changes can drop them too
+class Tombstone(Base):
+    __tablename__ = "tombstone"
+    __table_args__ = (
+        Index("ix_tombstone_owner_version", "owner", "version"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(Integer, ForeignKey("person.id"), nullable=False)
+    kind = Column(String(20), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.now)
+
+
+# Quantile sketch of expense costs per user and category (see sketches.py)
+class CategoryStats(Base):
+    __tablename__ = "category_stats"
+    __table_args__ = (
+        UniqueConstraint("owner", "category", name="uix_category_stats"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(Integer, ForeignKey("person.id"), nullable=False)
+    category = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    # Costs edited or deleted since the last rebuild; the digest only forgets them approximately
+    stale = Column(Integer, nullable=False, default=0)
+    digest = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
 # Database setup
-engine = create_engine("sqlite:///database.db", echo=False)
-Session = sessionmaker(bind=engine)
-session = Session()
+# The main database is the directory (people, usernames). With SHARD_COUNT > 0 each user's
+# expenses, categories, income and budgets live in a shard database instead.
+# Engines are created on first use, so importing this module never touches a database file.
+DIRECTORY_TABLES = [Person.__table__, AccountPurge.__table__]
+SHARD_TABLES = [
+    Category.__table__, Expense.__table__, Income.__table__, Budget.__table__,
+    ArchiveRollup.__table__, ArchiveCutoff.__table__, ArchiveBatch.__table__,
+    ChangeCounter.__table__, Tombstone.__table__, CategoryStats.__table__,
+]
+
+_engine_lock = threading.Lock()
+# Keyed by URL, so apps built with different settings (see main.create_app) each get their own
+_engines = {}
+_session_factories = {}
+
+
+def _create_engine(url: str):
+    settings = get_settings()
+    options = {"echo": settings.echo_sql}
+    for name in ("pool_size", "max_overflow", "pool_recycle"):
+        value = getattr(settings, name)
+        if value is not None:
+            options[name] = value
+    new_engine = create_engine(url, **options)
+
+    # WAL lets readers (and online backups) run alongside a writer
+    if settings.sqlite_wal and new_engine.dialect.name == "sqlite":
+        @event.listens_for(new_engine, "connect")
+        def _enable_wal(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.close()
+
+    return new_engine
+
+
+def _engine_for(url: str):
+    if url not in _engines:
+        with _engine_lock:
+            if url not in _engines:
+                new_engine = _create_engine(url)
+                _session_factories[url] = sessionmaker(bind=new_engine)
+                _engines[url] = new_engine
+    return _engines[url]
+
+
+def get_engine():
+    return _engine_for(get_settings().database_url)
+
+
+def Session():
+    """New session on the main (directory) database."""
+    url = get_settings().database_url
+    _engine_for(url)
+    return _session_factories[url]()
+
+
+def shard_count() -> int:
+    return get_settings().shard_count
+
+
+def shard_url(shard: int) -> str:
+    return get_settings().shard_url_template.format(n=shard)
+
+
+def get_shard_engine(shard: int):
+    return _engine_for(shard_url(shard))
+
+
+def session_for_shard(shard: int):
+    url = shard_url(shard)
+    _engine_for(url)
+    return _session_factories[url]()
+
+
+def shard_for_user(user_id: int) -> int:
+    return user_id % shard_count()
+
+
+def session_for_user(user_id: int):
+    """Session holding a user's data: their shard, or the main database when sharding is off."""
+    if not shard_count():
+        return Session()
+    return session_for_shard(shard_for_user(user_id))
+
+
+def dispose_engines(settings=None):
+    """
+    Close pooled connections and forget the engines, e.g. after the settings change.
+    With settings, only the engines of their databases.
+    """
+    with _engine_lock:
+        if settings is None:
+            urls = list(_engines)
+        else:
+            urls = [settings.database_url]
+            urls += [settings.shard_url_template.format(n=shard) for shard in range(settings.shard_count)]
+        for url in urls:
+            engine = _engines.pop(url, None)
+            if engine is not None:
+                engine.dispose()
+            _session_factories.pop(url, None)
+
+
+# Columns added after the first release, so create_all won't add them to an existing database.db
+ADDED_COLUMNS = {
+    Person.__table__: [("disabled", "BOOLEAN NOT NULL DEFAULT 0"), ("is_admin", "BOOLEAN NOT NULL DEFAULT 0")],
+    AccountPurge.__table__: [("heartbeat_at", "DATETIME")],
+    # Rows from before versioning all start at version 1, so a sync from 0 returns them
+    Category.__table__: [("version", "INTEGER NOT NULL DEFAULT 1")],
+    Expense.__table__: [("version", "INTEGER NOT NULL DEFAULT 1")],
+    Income.__table__: [("version", "INTEGER NOT NULL DEFAULT 1")],
+    Budget.__table__: [("version", "INTEGER NOT NULL DEFAULT 1")],
+}
+
+
+def _add_missing_columns(engine, tables):
+    inspector = inspect(engine)
+    for table in tables:
+        if table not in ADDED_COLUMNS:
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for name, ddl in ADDED_COLUMNS[table]:
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {ddl}"))
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+def reserve_ids(conn, table_name: str, floor: int):
+    """Make sure rows inserted into table_name from now on get ids above floor."""
+    if not floor:
+        return
+    if conn.dialect.name == "sqlite":
+        updated = conn.execute(
+            text("UPDATE sqlite_sequence SET seq = :floor WHERE name = :name AND seq < :floor"),
+            {"name": table_name, "floor": floor},
+        ).rowcount
+        if not updated and conn.execute(
+            text("SELECT 1 FROM sqlite_sequence WHERE name = :name"), {"name": table_name}
+        ).first() is None:
+            conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :floor)"),
+                         {"name": table_name, "floor": floor})
+    elif conn.dialect.name == "postgresql":
+        conn.execute(
+            text("SELECT setval(pg_get_serial_sequence(:name, 'id'), "
+                 "GREATEST(:floor, nextval(pg_get_serial_sequence(:name, 'id'))))"),
+            {"name": table_name, "floor": floor},
+        )
+
+
+def _freed_ids_floor(conn, table_name: str) -> int:
+    """Highest id the old table may have freed: purged people, or archived rows."""
+    if table_name == Person.__tablename__:
+        return conn.execute(text("SELECT MAX(person_id) FROM account_purge")).scalar() or 0
+    from archive import max_archived_id
+    return max_archived_id(table_name)
+
+
+def _add_autoincrement(engine, tables):
+    """
+    SQLite can't add AUTOINCREMENT to an existing table, so person, expense and income
+    tables from before it are copied into new ones. Ids the old tables may have freed
+    (purged people, archived rows) are reserved too.
+
+    The copy is built under a new name and renamed at the end: renaming the old table
+    away first would make SQLite point other tables' foreign keys at it.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    for table in tables:
+        if not table.kwargs.get("sqlite_autoincrement"):
+            continue
+        with engine.begin() as conn:
+            sql = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+            ).scalar()
+            if sql is None or "AUTOINCREMENT" in sql.upper():
+                continue
+
+            indexes = conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"),
+                {"name": table.name},
+            ).scalars().all()
+            for index in indexes:
+                conn.execute(text(f'DROP INDEX "{index}"'))
+            # A copy in the same metadata, so its foreign keys resolve
+            new_table = table.to_metadata(Base.metadata, name=f"{table.name}_new")
+            try:
+                conn.execute(CreateTable(new_table))
+            finally:
+                Base.metadata.remove(new_table)
+            columns = ", ".join(c.name for c in table.columns)
+            conn.execute(text(f"INSERT INTO {table.name}_new ({columns}) SELECT {columns} FROM {table.name}"))
+            conn.execute(text(f"DROP TABLE {table.name}"))
+            conn.execute(text(f"ALTER TABLE {table.name}_new RENAME TO {table.name}"))
+            for index in table.indexes:
+                index.create(bind=conn)
+
+            reserve_ids(conn, table.name, _freed_ids_floor(conn, table.name))
+
+
+def _backfill(engine):
+    # Cost sketches for categories from before category_stats existed
+    from sketches import backfill_stats
+    backfill_stats(engine)
+
+
+def migrate():
+    """Create missing tables and columns on the main database and every shard."""
+    engine = get_engine()
+    if shard_count():
+        Base.metadata.create_all(bind=engine, tables=DIRECTORY_TABLES)
+        _add_missing_columns(engine, DIRECTORY_TABLES)
+        _add_autoincrement(engine, DIRECTORY_TABLES)
+        for shard in range(shard_count()):
+            shard_engine = get_shard_engine(shard)
+            Base.metadata.create_all(bind=shard_engine, tables=SHARD_TABLES)
+            _add_missing_columns(shard_engine, SHARD_TABLES)
+            _add_autoincrement(shard_engine, SHARD_TABLES)
+            _backfill(shard_engine)
+    else:
+        Base.metadata.create_all(bind=engine)
+        _add_missing_columns(engine, DIRECTORY_TABLES + SHARD_TABLES)
+        _add_autoincrement(engine, DIRECTORY_TABLES + SHARD_TABLES)
+        _backfill(engine)
+
 
-# Create tables if they don't exist
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+if __name__ == "__main__":
+    migrate()
+    print("Database schema is up to date")
@@ -1,77 +1,172 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+import contextvars
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, BackgroundTasks, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import func, literal
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
-from database import Session as DBSession, Person, Expense, Category, Income, Budget
-from auth import create_access_token, get_current_user, create_refresh_token, verify_refresh_token
+from typing import List, Optional
+from database import Person, Expense, Category, Income, Budget, migrate, dispose_engines
+from auth import (
+    create_access_token, get_current_user, create_refresh_token, verify_refresh_token,
+    get_db, get_directory_db, get_admin_user, is_reserved_username
+)
 from schemas import (
     PersonCreate, PersonUpdate, PersonOut,
-    ExpenseCreate, ExpenseOut, PaginatedResponse,
-    Token, Login, IncomeCreate, IncomeOut,
-    BudgetCreate, BudgetOut, CategorySummary, MonthlySummary
+    ExpenseCreate, PartialExpenseOut, PaginatedResponse,
+    Token, Login, IncomeCreate, PartialIncomeOut,
+    BudgetCreate, PartialBudgetOut, CategorySummary, MonthlySummary, CategoryStatsOut,
+    ExpenseBatch, IncomeBatch, BatchResponse, ChangesResponse
+)
+from settings import Settings, get_settings, use_settings
+from compression import CompressionMiddleware
+from metrics import RequestTimingMiddleware
+from backup import run_backup, check_online_backup, backup_in_progress, last_report, list_snapshots
+from utils import (
+    get_sort_options, get_financial_summary, parse_fields, select_fields,
+    decode_cursor, encode_cursor, cursor_offset, keyset_page,
+    EXPENSE_COLUMNS, INCOME_COLUMNS, BUDGET_COLUMNS, CATEGORY_COLUMNS
 )
-from utils import get_sort_options, get_financial_summary
+from purge import request_account_purge, purge_account, resume_pending_purges
+from batch import MAX_BATCH_OPERATIONS, apply_expense_batch, apply_income_batch
+from changes import CHANGES_PAGE_SIZE, next_version, record_deletes, get_changes
+from sketches import observe_cost, replace_cost, forget_cost, category_report, rebuild_stale_stats
+from archive import reaches_archive, archived_by_category, page_with_archive
+
+router = APIRouter()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = app.state.settings
+    with use_settings(settings):
+        if get_settings().migrate_on_startup:
+            migrate()
+            # Only once the schema is known to exist; otherwise `python purge.py` resumes them.
+            # The thread gets a copy of the context, so it sees this app's settings too.
+            context = contextvars.copy_context()
+            threading.Thread(target=context.run, args=(resume_pending_purges,), daemon=True).start()
+    yield
+    dispose_engines(settings or get_settings())
+
+
+class AppSettingsMiddleware:
+    """Makes get_settings() return the app's own settings while it handles a request."""
+
+    def __init__(self, app, settings: Optional[Settings]):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        with use_settings(self.settings):
+            await self.app(scope, receive, send)
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the API. Nothing touches the database until the app starts or serves a request.
+    Without settings the app follows the process-wide ones (settings.get_settings).
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    if settings is None:
+        settings = get_settings()
+
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
 
-app = FastAPI()
+    if settings.compression_enabled:
+        app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_size)
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    app.add_middleware(RequestTimingMiddleware)
+    # Outermost, so every other middleware and background task runs with the app's settings
+    app.add_middleware(AppSettingsMiddleware, settings=app.state.settings)
 
+    app.include_router(router)
+    return app
+
+
+_app = None
 
-# Database dependency
-def get_db():
-    db = DBSession()
-    try:
-        yield db
-    finally:
-        db.close()
 
+def __getattr__(name):
+    # Keeps `uvicorn main:app` working without building the app on import
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-@app.get("/")
+
+@router.get("/")
 def read_root():
     return {"boot up complete": "Tracker API is running!"}
 
 
-@app.get("/me", response_model=PersonOut)
+@router.get("/me", response_model=PersonOut)
 def get_me(current_user: Person = Depends(get_current_user)):
     return current_user
 
 
-@app.get("/me/expenses", response_model=PaginatedResponse[ExpenseOut])
+@router.get("/me/expenses", response_model=PaginatedResponse[PartialExpenseOut], response_model_exclude_unset=True)
 def get_my_expenses(
         page: int = 1,
         limit: int = 20,
         sort: str = "date_desc",
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
-    order_by = get_sort_options(sort)
-    query = db.query(Expense).filter(Expense.owner == current_user.id).order_by(order_by)
+    wanted = parse_fields(fields, EXPENSE_COLUMNS)
+    after = decode_cursor(cursor)
+
+    filters = [Expense.owner == current_user.id]
+    if start_date:
+        filters.append(Expense.date >= start_date)
+    if end_date:
+        filters.append(Expense.date <= end_date)
+
+    cutoff = reaches_archive(db, current_user.id, start_date)
+    if cutoff:
+        offset = cursor_offset(after) if after else (page - 1) * limit
+        # id, date and cost are always needed to merge with the archive
+        query = select_fields(db, EXPENSE_COLUMNS, wanted, Expense.id, Expense.date, Expense.cost).filter(*filters)
+        if "category" in wanted:
+            query = query.outerjoin(Category, Expense.category_id == Category.id)
+        try:
+            total_items, records = page_with_archive(
+                db, current_user.id, "expense", query, lambda row: row._asdict(),
+                cutoff, sort, offset, limit, start_date, end_date
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{e}; sort by date or set start_date")
+        next_cursor = encode_cursor({"o": offset + limit}) if offset + limit < total_items else None
+        result = [{f: r[f] for f in wanted} for r in records]
+    else:
+        sort_column, descending = get_sort_options(sort)
+        query = select_fields(db, EXPENSE_COLUMNS, wanted, Expense.id, sort_column).filter(*filters)
+        if "category" in wanted:
+            query = query.outerjoin(Category, Expense.category_id == Category.id)
 
-    total_items = query.count()
-    total_pages = (total_items + limit - 1) // limit
+        total_items = db.query(func.count(Expense.id)).filter(*filters).scalar()
 
-    expenses = query.offset((page - 1) * limit).limit(limit).all()
+        rows, next_cursor = keyset_page(query, sort_column, Expense.id, descending, after, (page - 1) * limit, limit)
+        result = [{f: getattr(row, f) for f in wanted} for row in rows]
 
-    result = [
-        ExpenseOut(
-            id=e.id,
-            item=e.item,
-            cost=e.cost,
-            date=e.date,
-            category=e.category_rel.name if e.category_rel else None,
-        )
-        for e in expenses
-    ]
+    total_pages = (total_items + limit - 1) // limit
 
     return {
         "metadata": {
@@ -79,12 +174,13 @@ def get_my_expenses(
             "total_pages": total_pages,
             "current_page": page,
             "limit": limit,
+            "next_cursor": next_cursor,
         },
         "data": result,
     }
 
 
-@app.get("/me/summary")
+@router.get("/me/summary")
 def financial_summary(
         days: int = Query(30, ge=1),
         db: Session = Depends(get_db),
@@ -94,19 +190,24 @@ def financial_summary(
     return summary
 
 
-@app.get("/me/categories")
+@router.get("/me/categories")
 def get_my_categories(
         page: int = 1,
         limit: int = 20,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
-    query = db.query(Category).filter(Category.owner == current_user.id)
+    wanted = parse_fields(fields, CATEGORY_COLUMNS)
+    query = select_fields(db, CATEGORY_COLUMNS, wanted, Category.id).filter(Category.owner == current_user.id)
 
-    total_items = query.count()
+    total_items = db.query(func.count(Category.id)).filter(Category.owner == current_user.id).scalar()
     total_pages = (total_items + limit - 1) // limit
 
-    categories = query.offset((page - 1) * limit).limit(limit).all()
+    categories, next_cursor = keyset_page(
+        query, Category.id, Category.id, False, decode_cursor(cursor), (page - 1) * limit, limit
+    )
 
     return {
         "metadata": {
@@ -114,38 +215,84 @@ def get_my_categories(
             "total_pages": total_pages,
             "current_page": page,
             "limit": limit,
+            "next_cursor": next_cursor,
         },
-        "data": [{"id": c.id, "name": c.name} for c in categories],
+        "data": [{f: getattr(c, f) for f in wanted} for c in categories],
     }
 
 
-@app.get("/me/income", response_model=List[IncomeOut])
+@router.get("/me/income", response_model=List[PartialIncomeOut], response_model_exclude_unset=True)
 def get_my_income(
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
-    income = (
-        db.query(Income)
-        .filter(Income.owner == current_user.id)
-        .order_by(Income.date.desc())
-        .all()
-    )
-    return income
+    wanted = parse_fields(fields, INCOME_COLUMNS)
+    after = decode_cursor(cursor)
+
+    filters = [Income.owner == current_user.id]
+    if start_date:
+        filters.append(Income.date >= start_date)
+    if end_date:
+        filters.append(Income.date <= end_date)
+
+    cutoff = reaches_archive(db, current_user.id, start_date)
+    if cutoff:
+        offset = cursor_offset(after)
+        query = select_fields(db, INCOME_COLUMNS, wanted, Income.id, Income.date).filter(*filters)
+        total, records = page_with_archive(
+            db, current_user.id, "income", query, lambda row: row._asdict(),
+            cutoff, "date_desc", offset, limit, start_date, end_date
+        )
+        end = offset + limit if limit else None
+        next_cursor = encode_cursor({"o": end}) if end and end < total else None
+        result = [{f: i[f] for f in wanted} for i in records]
+    else:
+        query = select_fields(db, INCOME_COLUMNS, wanted, Income.id, Income.date).filter(*filters)
+        rows, next_cursor = keyset_page(query, Income.date, Income.id, True, after, 0, limit)
+        result = [{f: getattr(row, f) for f in wanted} for row in rows]
 
+    # The body stays a plain list, so the next page is announced in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return result
 
-@app.get("/me/budgets", response_model=List[BudgetOut])
+
+@router.get("/me/budgets", response_model=List[PartialBudgetOut], response_model_exclude_unset=True)
 def get_my_budgets(
+        response: Response,
+        limit: Optional[int] = Query(None, ge=1),
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
-    budgets = db.query(Budget).filter(
-        Budget.owner == current_user.id
-    ).all()
+    wanted = parse_fields(fields, BUDGET_COLUMNS)
+    query = select_fields(db, BUDGET_COLUMNS, wanted, Budget.id).filter(Budget.owner == current_user.id)
+
+    budgets, next_cursor = keyset_page(query, Budget.id, Budget.id, False, decode_cursor(cursor), 0, limit)
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [{f: getattr(b, f) for f in wanted} for b in budgets]
+
 
-    return budgets
+@router.get("/me/changes", response_model=ChangesResponse)
+def get_my_changes(
+        since: int = Query(0, ge=0),
+        limit: int = Query(CHANGES_PAGE_SIZE, ge=1, le=10000),
+        db: Session = Depends(get_db),
+        current_user: Person = Depends(get_current_user)
+):
+    return get_changes(db, current_user.id, since, limit)
 
 
-@app.get("/me/reports/monthly", response_model=MonthlySummary)
+@router.get("/me/reports/monthly", response_model=MonthlySummary)
 def monthly_summary(
         month: int,
         year: int,
@@ -169,6 +316,14 @@ def monthly_summary(
         else:
             result.append(CategorySummary(category="Uncategorized", total=total))
 
+    # Archived months come from the rollups
+    month_start = datetime(year, month, 1)
+    month_end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    archived = archived_by_category(db, current_user.id, month_start, month_end)
+    for r in result:
+        r.total += archived.pop(r.category, 0)
+    result.extend(CategorySummary(category=name, total=total) for name, total in archived.items())
+
     total_expense = sum([r.total for r in result])
 
     return MonthlySummary(
@@ -179,13 +334,21 @@ def monthly_summary(
     )
 
 
-@app.post("/token", response_model=Token)
+@router.get("/me/reports/category-stats", response_model=List[CategoryStatsOut])
+def category_stats(
+        db: Session = Depends(get_db),
+        current_user: Person = Depends(get_current_user)
+):
+    return category_report(db, current_user.id)
+
+
+@router.post("/token", response_model=Token)
 def token(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_directory_db)
 ):
     user = db.query(Person).filter(Person.username == form_data.username).first()
-    if not user or not user.check_password(form_data.password):
+    if not user or user.disabled or not user.check_password(form_data.password):
         raise HTTPException(status_code=401, detail="Incorrect credentials")
 
     token_data = {"sub": str(user.id)}
@@ -198,7 +361,7 @@ def token(
     }
 
 
-@app.post("/refresh")
+@router.post("/refresh")
 def refresh_access_token(refresh_token: str):
     payload = verify_refresh_token(refresh_token)
     user_id = payload.get("sub")
@@ -211,8 +374,11 @@ def refresh_access_token(refresh_token: str):
     }
 
 
-@app.post("/register")
-def register(person: PersonCreate, db: Session = Depends(get_db)):
+@router.post("/register")
+def register(person: PersonCreate, db: Session = Depends(get_directory_db)):
+    if is_reserved_username(person.username):
+        raise HTTPException(status_code=400, detail="Username is reserved")
+
     existing_user = db.query(Person).filter(Person.username == person.username).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
@@ -233,7 +399,7 @@ def register(person: PersonCreate, db: Session = Depends(get_db)):
     return {"message": f"User {person.username} created successfully", "id": new_person.id}
 
 
-@app.post("/income")
+@router.post("/income")
 def create_income(
         income: IncomeCreate,
         db: Session = Depends(get_db),
@@ -243,7 +409,8 @@ def create_income(
         amount=income.amount,
         source=income.source,
         date=income.date or datetime.now(),
-        owner=current_user.id
+        owner=current_user.id,
+        version=next_version(db, current_user.id)
     )
 
     db.add(new_income)
@@ -258,46 +425,80 @@ def create_income(
     }
 
 
-@app.post("/expenses")
+@router.post("/expenses")
 def create_expense(
         expense: ExpenseCreate,
+        background_tasks: BackgroundTasks,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
     expense_owner = current_user.id
+    version = next_version(db, expense_owner)
 
     existing_category = db.query(Category).filter(
         Category.name == expense.category,
         Category.owner == expense_owner
     ).first()
 
+    # Category, expense and version bump commit together, so /me/changes never sees one without the other
     if not existing_category:
-        category = Category(name=expense.category, owner=expense_owner)
+        category = Category(name=expense.category, owner=expense_owner, version=version)
         db.add(category)
-        db.commit()
-        db.refresh(category)
+        db.flush()
     else:
         category = existing_category
 
+    outlier = observe_cost(db, expense_owner, category.name, expense.cost)
+
     new_expense = Expense(
         cost=expense.cost,
         item=expense.item,
         owner=expense_owner,
         category_id=category.id,
-        date=expense.date or datetime.now()
+        date=expense.date or datetime.now(),
+        version=version
     )
     db.add(new_expense)
     db.commit()
     db.refresh(new_expense)
+    background_tasks.add_task(rebuild_stale_stats, expense_owner)
 
     return {
         "message": f"Expense {new_expense.item} added successfully",
         "expense_id": new_expense.id,
         "category": category.name,
+        "outlier": outlier,
     }
 
 
-@app.post("/budgets")
+@router.post("/expenses/batch", response_model=BatchResponse)
+def batch_expenses(
+        batch: ExpenseBatch,
+        background_tasks: BackgroundTasks,
+        db: Session = Depends(get_db),
+        current_user: Person = Depends(get_current_user)
+):
+    if len(batch.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+
+    result = apply_expense_batch(db, current_user.id, batch.operations)
+    background_tasks.add_task(rebuild_stale_stats, current_user.id)
+    return result
+
+
+@router.post("/income/batch", response_model=BatchResponse)
+def batch_income(
+        batch: IncomeBatch,
+        db: Session = Depends(get_db),
+        current_user: Person = Depends(get_current_user)
+):
+    if len(batch.operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+
+    return apply_income_batch(db, current_user.id, batch.operations)
+
+
+@router.post("/budgets")
 def create_budget(
         budget: BudgetCreate,
         db: Session = Depends(get_db),
@@ -309,7 +510,8 @@ def create_budget(
         period=budget.period,
         start_date=budget.start_date,
         end_date=budget.end_date,
-        owner=current_user.id
+        owner=current_user.id,
+        version=next_version(db, current_user.id)
     )
 
     db.add(new_budget)
@@ -319,10 +521,11 @@ def create_budget(
     return {"message": "Budget created", "id": new_budget.id}
 
 
-@app.patch("/expenses/{expense_id}")
+@router.patch("/expenses/{expense_id}")
 def update_expense(
         expense_id: int,
         updated: ExpenseCreate,
+        background_tasks: BackgroundTasks,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
@@ -334,21 +537,28 @@ def update_expense(
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    outlier = False
+    if expense.category_rel and updated.cost != expense.cost:
+        outlier = replace_cost(db, current_user.id, expense.category_rel.name, expense.cost, updated.cost)
+
     expense.item = updated.item
     expense.cost = updated.cost
+    expense.version = next_version(db, current_user.id)
 
     db.commit()
     db.refresh(expense)
+    background_tasks.add_task(rebuild_stale_stats, current_user.id)
 
     return {
         "message": f"Expense {expense.id} updated successfully",
         "item": expense.item,
         "cost": expense.cost,
         "date": expense.date,
+        "outlier": outlier,
     }
 
 
-@app.patch("/budgets/{budget_id}")
+@router.patch("/budgets/{budget_id}")
 def update_budget(
         budget_id: int,
         updated: BudgetCreate,
@@ -368,6 +578,7 @@ def update_budget(
     budget.period = updated.period
     budget.start_date = updated.start_date
     budget.end_date = updated.end_date
+    budget.version = next_version(db, current_user.id)
 
     db.commit()
     db.refresh(budget)
@@ -375,15 +586,17 @@ def update_budget(
     return {"message": "Budget updated"}
 
 
-@app.patch("/profile")
+@router.patch("/profile")
 def update_profile(
         updated: PersonUpdate,
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_directory_db),
         current_user: Person = Depends(get_current_user)
 ):
     user = current_user
 
     if updated.username is not None:
+        if is_reserved_username(updated.username):
+            raise HTTPException(status_code=400, detail="Username is reserved")
         existing = db.query(Person).filter(Person.username == updated.username, Person.id != user.id).first()
         if existing:
             raise HTTPException(status_code=400, detail="Username already taken")
@@ -410,7 +623,7 @@ def update_profile(
     }
 
 
-@app.patch("/income/{income_id}")
+@router.patch("/income/{income_id}")
 def update_income(
         income_id: int,
         updated: IncomeCreate,
@@ -428,6 +641,7 @@ def update_income(
     income.amount = updated.amount
     income.source = updated.source
     income.date = updated.date or income.date
+    income.version = next_version(db, current_user.id)
 
     db.commit()
     db.refresh(income)
@@ -435,9 +649,10 @@ def update_income(
     return {"message": "Income updated successfully"}
 
 
-@app.delete("/expenses/{expense_id}")
+@router.delete("/expenses/{expense_id}")
 def delete_expense(
         expense_id: int,
+        background_tasks: BackgroundTasks,
         db: Session = Depends(get_db),
         current_user: Person = Depends(get_current_user)
 ):
@@ -449,13 +664,17 @@ def delete_expense(
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
 
+    if expense.category_rel:
+        forget_cost(db, current_user.id, expense.category_rel.name, expense.cost)
+    record_deletes(db, current_user.id, "expense", [expense.id], next_version(db, current_user.id))
     db.delete(expense)
     db.commit()
+    background_tasks.add_task(rebuild_stale_stats, current_user.id)
 
     return {"message": f"Expense {expense_id} deleted successfully"}
 
 
-@app.delete("/income/{income_id}")
+@router.delete("/income/{income_id}")
 def delete_income(
         income_id: int,
         db: Session = Depends(get_db),
@@ -469,13 +688,14 @@ def delete_income(
     if not income:
         raise HTTPException(status_code=404, detail="Income not found")
 
+    record_deletes(db, current_user.id, "income", [income.id], next_version(db, current_user.id))
     db.delete(income)
     db.commit()
 
     return {"message": "Income deleted successfully"}
 
 
-@app.delete("/budgets/{budget_id}")
+@router.delete("/budgets/{budget_id}")
 def delete_budget(
         budget_id: int,
         db: Session = Depends(get_db),
@@ -489,23 +709,46 @@ def delete_budget(
     if not budget:
         raise HTTPException(status_code=404, detail="Budget not found")
 
+    record_deletes(db, current_user.id, "budget", [budget.id], next_version(db, current_user.id))
     db.delete(budget)
     db.commit()
 
     return {"message": "Budget deleted"}
 
 
-@app.delete("/account")
+@router.delete("/account", status_code=202)
 def delete_account(
-        db: Session = Depends(get_db),
+        background_tasks: BackgroundTasks,
+        db: Session = Depends(get_directory_db),
         current_user: Person = Depends(get_current_user)
 ):
-    db.query(Expense).filter(Expense.owner == current_user.id).delete()
-    db.query(Category).filter(Category.owner == current_user.id).delete()
-    db.query(Income).filter(Income.owner == current_user.id).delete()
-    db.query(Budget).filter(Budget.owner == current_user.id).delete()
+    # Disable now, purge the data in chunks after the response is sent
+    request_account_purge(db, current_user)
+    background_tasks.add_task(purge_account, current_user.id)
+
+    return {"message": "Your account has been disabled and its data is being deleted"}
 
-    db.delete(current_user)
-    db.commit()
 
-    return {"message": "Your account and all related data have been deleted successfully"}
\ No newline at end of file
+@router.post("/admin/backup", status_code=202)
+def start_backup(
+        background_tasks: BackgroundTasks,
+        admin: Person = Depends(get_admin_user)
+):
+    try:
+        check_online_backup()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if backup_in_progress():
+        raise HTTPException(status_code=409, detail="A backup is already running")
+
+    background_tasks.add_task(run_backup)
+    return {"message": "Backup started"}
+
+
+@router.get("/admin/backup")
+def backup_status(admin: Person = Depends(get_admin_user)):
+    return {
+        "in_progress": backup_in_progress(),
+        "last_backup": last_report(),
+        "snapshots": list_snapshots(),
+    }
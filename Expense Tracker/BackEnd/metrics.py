@@ -0,0 +1,48 @@
+import statistics
+import threading
+import time
+from collections import deque
+
+# Enough recent requests to compare latency before and during a backup
+MAX_SAMPLES = 10000
+
+_samples = deque(maxlen=MAX_SAMPLES)
+_lock = threading.Lock()
+
+
+def record_request(started: float, duration: float):
+    with _lock:
+        _samples.append((started, duration))
+
+
+def latency_between(start: float, end: float) -> dict:
+    """Request count and latency percentiles (ms) for requests that started in [start, end)."""
+    with _lock:
+        durations = sorted(d for s, d in _samples if start <= s < end)
+    if not durations:
+        return {"requests": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+    return {
+        "requests": len(durations),
+        "p50_ms": round(statistics.median(durations) * 1000, 2),
+        "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 2),
+        "max_ms": round(durations[-1] * 1000, 2),
+    }
+
+
+class RequestTimingMiddleware:
+    """Records how long each HTTP request takes, for the backup latency report."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        clock = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            record_request(started, time.perf_counter() - clock)
@@ -0,0 +1,182 @@
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import (
+    Session as DBSession, Person, Expense, Category, Income, Budget, AccountPurge,
+    ArchiveRollup, ArchiveCutoff, ArchiveBatch, ChangeCounter, Tombstone, CategoryStats, shard_count, session_for_user
+)
+from archive import delete_user_archive
+
+logger = logging.getLogger(__name__)
+
+# Order matters: expenses reference categories, everything references the person
+PURGE_STAGES = [
+    ("expense", Expense),
+    ("category", Category),
+    ("income", Income),
+    ("budgets", Budget),
+    ("archive_rollup", ArchiveRollup),
+    ("archive_cutoff", ArchiveCutoff),
+    ("archive_batch", ArchiveBatch),
+    ("change_counter", ChangeCounter),
+    ("tombstone", Tombstone),
+    ("category_stats", CategoryStats),
+]
+
+PURGE_CHUNK_SIZE = 500
+# Pause between chunks so other requests can grab the SQLite write lock
+PURGE_CHUNK_PAUSE = 0.05
+# A running purge whose heartbeat is older than this is taken over by the next worker
+PURGE_STALE_AFTER = timedelta(minutes=10)
+
+
+def request_account_purge(db, person: Person) -> AccountPurge:
+    """Disable the account and record a pending purge. Cheap enough to run inside the request."""
+    purge = db.query(AccountPurge).filter(AccountPurge.person_id == person.id).first()
+    if not purge:
+        purge = AccountPurge(person_id=person.id)
+        db.add(purge)
+    elif purge.status != "running":
+        # Left over from an earlier request for this id; start the purge over
+        purge.status = "pending"
+        purge.stage = PURGE_STAGES[0][0]
+        purge.rows_deleted = 0
+        purge.requested_at = datetime.now()
+        purge.finished_at = None
+        purge.heartbeat_at = None
+
+    person.disabled = True
+    db.commit()
+    db.refresh(purge)
+    return purge
+
+
+def _delete_chunk(db, model, owner_id: int, chunk_size: int) -> int:
+    ids = [
+        row_id for (row_id,) in
+        db.query(model.id).filter(model.owner == owner_id).limit(chunk_size).all()
+    ]
+    if not ids:
+        return 0
+
+    return db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+
+
+def _claim(db, person_id: int) -> bool:
+    """
+    Mark the purge as running, unless another worker already is. The check and the
+    update are one statement, so when several workers try at once only one wins.
+    """
+    now = datetime.now()
+    claimed = db.query(AccountPurge).filter(
+        AccountPurge.person_id == person_id,
+        or_(
+            AccountPurge.status.in_(("pending", "failed")),
+            and_(
+                AccountPurge.status == "running",
+                or_(AccountPurge.heartbeat_at == None, AccountPurge.heartbeat_at < now - PURGE_STALE_AFTER),
+            ),
+        ),
+    ).update({AccountPurge.status: "running", AccountPurge.heartbeat_at: now}, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def purge_account(person_id: int, chunk_size: int = PURGE_CHUNK_SIZE, pause: float = PURGE_CHUNK_PAUSE):
+    """
+    Delete everything owned by a disabled account in small committed chunks.
+
+    Progress is stored on the AccountPurge row after every chunk, and each chunk
+    only deletes rows that still exist, so a crashed purge can simply be run again.
+    """
+    db = DBSession()
+    # With sharding the data lives on the user's shard, the purge row and person in the directory
+    data_db = session_for_user(person_id) if shard_count() else db
+    claimed = False
+    try:
+        if not _claim(db, person_id):
+            return
+        claimed = True
+        purge = db.query(AccountPurge).filter(AccountPurge.person_id == person_id).first()
+
+        stage_names = [name for name, _ in PURGE_STAGES]
+        start = stage_names.index(purge.stage) if purge.stage in stage_names else len(PURGE_STAGES)
+
+        for name, model in PURGE_STAGES[start:]:
+            purge.stage = name
+            purge.heartbeat_at = datetime.now()
+            db.commit()
+
+            while True:
+                deleted = _delete_chunk(data_db, model, person_id, chunk_size)
+                if not deleted:
+                    break
+                data_db.commit()
+                purge.rows_deleted += deleted
+                purge.heartbeat_at = datetime.now()
+                db.commit()
+                if pause:
+                    time.sleep(pause)
+
+        delete_user_archive(person_id)
+        purge.stage = "person"
+        db.query(Person).filter(Person.id == person_id).delete(synchronize_session=False)
+        purge.status = "done"
+        purge.finished_at = datetime.now()
+        db.commit()
+    except Exception:
+        data_db.rollback()
+        db.rollback()
+        purge = db.query(AccountPurge).filter(AccountPurge.person_id == person_id).first()
+        if purge and claimed:
+            purge.status = "failed"
+            db.commit()
+        raise
+    finally:
+        if data_db is not db:
+            data_db.close()
+        db.close()
+
+
+def resume_pending_purges():
+    """
+    Pick up purges that were interrupted by a restart or crash. Every worker runs this
+    at startup; purge_account claims each one, so only one worker works on an account.
+    """
+    db = DBSession()
+    try:
+        pending = [
+            person_id for (person_id,) in
+            db.query(AccountPurge.person_id).filter(AccountPurge.status != "done").all()
+        ]
+    except SQLAlchemyError:
+        logger.exception("Could not look for interrupted account purges; is the database migrated?")
+        return []
+    finally:
+        db.close()
+
+    for person_id in pending:
+        try:
+            purge_account(person_id)
+        except Exception:
+            # Left as "failed" on its row, the next startup retries it
+            logger.exception("Purge of account %s failed", person_id)
+    return pending
+
+
+def main():
+    argparse.ArgumentParser(
+        description="Finish account purges that were interrupted, e.g. when the API runs with MIGRATE_ON_STARTUP=false."
+    ).parse_args()
+    logging.basicConfig()
+    for person_id in resume_pending_purges():
+        print(f"account {person_id}: purge resumed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional, List, Generic, TypeVar
+from typing import Optional, List, Generic, TypeVar, Literal
 
 T = TypeVar('T')
 
@@ -53,6 +53,14 @@ class ExpenseOut(BaseModel):
     class Config:
         orm_mode = True
 
+# List endpoints return only the columns asked for with fields=, so every field may be missing
+class PartialExpenseOut(BaseModel):
+    id: Optional[int] = None
+    item: Optional[str] = None
+    cost: Optional[float] = None
+    date: Optional[datetime] = None
+    category: Optional[str] = None
+
 # Income schema
 class IncomeCreate(BaseModel):
     amount: float
@@ -68,6 +76,12 @@ class IncomeOut(BaseModel):
     class Config:
         orm_mode = True
 
+class PartialIncomeOut(BaseModel):
+    id: Optional[int] = None
+    amount: Optional[float] = None
+    source: Optional[str] = None
+    date: Optional[datetime] = None
+
 # Budget schema
 class BudgetCreate(BaseModel):
     category: str
@@ -87,6 +101,76 @@ class BudgetOut(BaseModel):
     class Config:
         orm_mode = True
 
+class PartialBudgetOut(BaseModel):
+    id: Optional[int] = None
+    category: Optional[str] = None
+    limit: Optional[float] = None
+    period: Optional[str] = None
+    start_date: datetime | None = None
+    end_date: datetime | None = None
+
+# Batch schema
+class ExpenseBatchOperation(BaseModel):
+    op: Literal["update", "delete", "recategorize"]
+    id: int
+    item: Optional[str] = None
+    cost: Optional[float] = None
+    date: Optional[datetime] = None
+    category: Optional[str] = None
+
+class ExpenseBatch(BaseModel):
+    operations: List[ExpenseBatchOperation]
+
+class IncomeBatchOperation(BaseModel):
+    op: Literal["update", "delete"]
+    id: int
+    amount: Optional[float] = None
+    source: Optional[str] = None
+    date: Optional[datetime] = None
+
+class IncomeBatch(BaseModel):
+    operations: List[IncomeBatchOperation]
+
+class BatchResult(BaseModel):
+    id: int
+    op: str
+    status: Literal["ok", "not_found", "invalid"]
+    detail: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    applied: int
+    results: List[BatchResult]
+
+# Sync schema
+class CategoryChange(BaseModel):
+    id: int
+    name: str
+    version: int
+
+class ExpenseChange(ExpenseOut):
+    version: int
+
+class IncomeChange(IncomeOut):
+    version: int
+
+class BudgetChange(BudgetOut):
+    version: int
+
+class TombstoneOut(BaseModel):
+    kind: str
+    id: int
+    version: int
+
+class ChangesResponse(BaseModel):
+    version: int
+    has_more: bool
+    archived_before: Optional[datetime] = None
+    categories: List[CategoryChange]
+    expenses: List[ExpenseChange]
+    income: List[IncomeChange]
+    budgets: List[BudgetChange]
+    deleted: List[TombstoneOut]
+
 # Report schema
 class CategorySummary(BaseModel):
     category: str
@@ -98,6 +182,15 @@ class MonthlySummary(BaseModel):
     total_expense: float
     by_category: List[CategorySummary]
 
+class CategoryStatsOut(BaseModel):
+    category: str
+    count: int
+    min: float
+    max: float
+    p50: float
+    p90: float
+    p99: float
+
 # Response Models
 class Login(BaseModel):
     username: str
@@ -109,6 +202,7 @@ class Metadata(BaseModel):
     total_pages: int
     current_page: int
     limit: int
+    next_cursor: Optional[str] = None
 
 class PaginatedResponse(BaseModel, Generic[T]):
     metadata: Metadata
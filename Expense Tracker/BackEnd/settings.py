@@ -0,0 +1,125 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class Settings(BaseModel):
+    database_url: str = "sqlite:///database.db"
+    # {n} is replaced by the shard number
+    shard_url_template: str = "sqlite:///database_shard_{n}.db"
+    shard_count: int = 0
+    # Pool options are only passed to create_engine when set
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    pool_recycle: Optional[int] = None
+    echo_sql: bool = False
+    sqlite_wal: bool = True
+    # Create missing tables/columns and resume interrupted purges when the app starts;
+    # turn off and run `python database.py` and `python purge.py` instead
+    migrate_on_startup: bool = True
+
+    secret_key: str = "Hello World"
+    algorithm: str = "HS256"
+    access_token_expire_minutes: int = 60 * 24
+    refresh_token_expire_days: int = 7
+
+    # Move transactions older than this many months to archive_dir (0 disables archiving)
+    archive_after_months: int = 0
+    archive_dir: str = "archive"
+
+    # Online SQLite backups
+    backup_dir: str = "backups"
+    backup_keep: int = 7
+    backup_step_pages: int = 256
+    backup_step_pause: float = 0.01
+
+    # Usernames nobody can register or rename to, so no one can pose as the admins.
+    # Admin rights themselves are the person.is_admin flag (see admin_tool.py).
+    admin_usernames: List[str] = []
+
+    # Compress responses of at least this many bytes (brotli when installed, else gzip)
+    compression_enabled: bool = True
+    compression_min_size: int = 1024
+
+    cors_origins: List[str] = ["http://localhost:5173", "http://127.0.0.1:5173"]
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        defaults = cls()
+        origins = os.getenv("CORS_ORIGINS")
+        admins = os.getenv("ADMIN_USERNAMES", "")
+        return cls(
+            database_url=os.getenv("DATABASE_URL", defaults.database_url),
+            shard_url_template=os.getenv("SHARD_URL_TEMPLATE", defaults.shard_url_template),
+            shard_count=_env_int("SHARD_COUNT", defaults.shard_count),
+            pool_size=_env_int("DB_POOL_SIZE", None),
+            max_overflow=_env_int("DB_MAX_OVERFLOW", None),
+            pool_recycle=_env_int("DB_POOL_RECYCLE", None),
+            echo_sql=_env_bool("DB_ECHO", defaults.echo_sql),
+            sqlite_wal=_env_bool("SQLITE_WAL", defaults.sqlite_wal),
+            migrate_on_startup=_env_bool("MIGRATE_ON_STARTUP", defaults.migrate_on_startup),
+            secret_key=os.getenv("SECRET_KEY", defaults.secret_key),
+            algorithm=os.getenv("ALGORITHM", defaults.algorithm),
+            access_token_expire_minutes=_env_int("ACCESS_TOKEN_EXPIRE_MINUTES", defaults.access_token_expire_minutes),
+            refresh_token_expire_days=_env_int("REFRESH_TOKEN_EXPIRE_DAYS", defaults.refresh_token_expire_days),
+            archive_after_months=_env_int("ARCHIVE_AFTER_MONTHS", defaults.archive_after_months),
+            archive_dir=os.getenv("ARCHIVE_DIR", defaults.archive_dir),
+            backup_dir=os.getenv("BACKUP_DIR", defaults.backup_dir),
+            backup_keep=_env_int("BACKUP_KEEP", defaults.backup_keep),
+            backup_step_pages=_env_int("BACKUP_STEP_PAGES", defaults.backup_step_pages),
+            backup_step_pause=_env_float("BACKUP_STEP_PAUSE", defaults.backup_step_pause),
+            admin_usernames=[a.strip() for a in admins.split(",") if a.strip()],
+            compression_enabled=_env_bool("COMPRESSION_ENABLED", defaults.compression_enabled),
+            compression_min_size=_env_int("COMPRESSION_MIN_SIZE", defaults.compression_min_size),
+            cors_origins=[o.strip() for o in origins.split(",") if o.strip()] if origins else defaults.cors_origins,
+        )
+
+
+_settings: Optional[Settings] = None
+# Set while an app built with its own settings handles a request (see main.create_app)
+_app_settings: ContextVar[Optional[Settings]] = ContextVar("app_settings", default=None)
+
+
+def get_settings() -> Settings:
+    global _settings
+    app_settings = _app_settings.get()
+    if app_settings is not None:
+        return app_settings
+    if _settings is None:
+        _settings = Settings.from_env()
+    return _settings
+
+
+def set_settings(settings: Settings):
+    global _settings
+    _settings = settings
+
+
+@contextmanager
+def use_settings(settings: Optional[Settings]):
+    """get_settings() returns these settings inside the block; None keeps the process-wide ones."""
+    token = _app_settings.set(settings)
+    try:
+        yield
+    finally:
+        _app_settings.reset(token)
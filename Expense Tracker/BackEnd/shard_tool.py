@@ -0,0 +1,203 @@
+"""
+Split database.db into per-user shards, or move users after SHARD_COUNT changes.
+
+    python shard_tool.py split --shards 4
+    python shard_tool.py rebalance --from-shards 4 --shards 8
+
+Run these with the API stopped, then start it with SHARD_COUNT set to the same --shards value.
+If a run is interrupted, run the same command again before starting the API: split copies
+source rows over the ones it already copied, and rebalance redoes a half-moved user.
+"""
+import argparse
+
+from sqlalchemy import select, insert, delete, inspect, func
+
+from database import (
+    Base, Category, Tombstone, ChangeCounter, SHARD_TABLES,
+    get_engine, get_shard_engine, shard_count, shard_for_user, migrate, reserve_ids,
+    _add_missing_columns, _add_autoincrement
+)
+from sketches import backfill_stats
+from archive import ARCHIVE_MODELS, max_archived_id
+from settings import Settings, set_settings
+
+BATCH_SIZE = 1000
+
+# Tables synced through /me/changes, with the kind their tombstones use
+SYNCED_TABLES = {"category": "category", "expense": "expense", "income": "income", "budgets": "budget"}
+# A moved account is re-sent to clients; this many rows share each new version
+MOVE_VERSION_CHUNK = 500
+
+
+def split(drop_source: bool):
+    engine = get_engine()
+    source_tables = set(inspect(engine).get_table_names())
+    # With sharding on, migrate() only upgrades the directory tables in database.db,
+    # and the copy below reads the rest with the current columns
+    existing = [table for table in SHARD_TABLES if table.name in source_tables]
+    _add_missing_columns(engine, existing)
+    _add_autoincrement(engine, existing)
+
+    for table in existing:
+        copied = skipped = 0
+        last_id = 0
+        while True:
+            with engine.connect() as src:
+                rows = src.execute(
+                    select(table).where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+                ).mappings().all()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            buckets = {}
+            for row in rows:
+                if row["owner"] is None:
+                    skipped += 1
+                    continue
+                buckets.setdefault(shard_for_user(row["owner"]), []).append(dict(row))
+
+            # Ids are unique in the source, so they can be kept as-is. A rerun after an
+            # interrupted split finds some of this batch already copied, and replaces it.
+            for shard, shard_rows in buckets.items():
+                with get_shard_engine(shard).begin() as dst:
+                    dst.execute(delete(table).where(table.c.id.between(rows[0]["id"], last_id)))
+                    dst.execute(insert(table), shard_rows)
+                copied += len(shard_rows)
+
+        if drop_source:
+            with engine.begin() as src:
+                src.execute(delete(table))
+
+        print(f"{table.name}: copied {copied} rows, skipped {skipped} without an owner")
+
+    # Shards only know the ids they were given; ids used in database.db or in the archive stay taken
+    for kind, model in ARCHIVE_MODELS.items():
+        floor = max_archived_id(kind)
+        if model.__tablename__ in source_tables:
+            with engine.connect() as src:
+                floor = max(floor, src.execute(select(func.max(model.id))).scalar() or 0)
+        for shard in range(shard_count()):
+            with get_shard_engine(shard).begin() as dst:
+                reserve_ids(dst, model.__tablename__, floor)
+
+    # A database.db from before category_stats has nothing to copy there
+    for shard in range(shard_count()):
+        backfill_stats(get_shard_engine(shard))
+
+
+def _move_user(owner_id: int, src_engine, dst_engine):
+    """
+    Copy one user's rows to dst_engine, then delete them from src_engine.
+
+    Ids are only unique per shard, so rows get new ids on the destination. For
+    /me/changes that is a change like any other: the old ids get tombstones and the
+    rows come back under new versions. If the copy commits but the delete doesn't,
+    running again replaces the half-moved copy, since the source still has everything.
+    """
+    with src_engine.connect() as src:
+        data = {
+            table.name: [dict(r) for r in src.execute(select(table).where(table.c.owner == owner_id)).mappings()]
+            for table in SHARD_TABLES
+        }
+
+    counter = data.pop(ChangeCounter.__tablename__)
+    version = counter[0]["version"] if counter else 1
+    issued = 0
+
+    def next_version():
+        nonlocal issued
+        issued += 1
+        return version + 1 + (issued - 1) // MOVE_VERSION_CHUNK
+
+    def last_version():
+        return version + 1 + (issued - 1) // MOVE_VERSION_CHUNK if issued else version
+
+    tombstones = [
+        {"owner": owner_id, "kind": kind, "row_id": row["id"], "version": next_version()}
+        for name, kind in SYNCED_TABLES.items()
+        for row in data[name]
+    ]
+
+    with dst_engine.begin() as dst:
+        # Left over from an earlier run that stopped before clearing the source
+        for table in reversed(SHARD_TABLES):
+            dst.execute(delete(table).where(table.c.owner == owner_id))
+        # New ids must not clash with ids this user already has in the archive
+        for kind, model in ARCHIVE_MODELS.items():
+            reserve_ids(dst, model.__tablename__, max_archived_id(kind, owner_id))
+
+        category_ids = {}
+        for row in data["category"]:
+            old_id = row.pop("id")
+            row["version"] = next_version()
+            category_ids[old_id] = dst.execute(insert(Category.__table__).values(**row)).inserted_primary_key[0]
+
+        for row in data["expense"]:
+            row["category_id"] = category_ids.get(row["category_id"])
+        for table in SHARD_TABLES:
+            if table is Category.__table__ or not data.get(table.name):
+                continue
+            for row in data[table.name]:
+                row.pop("id", None)
+                if table.name in SYNCED_TABLES:
+                    row["version"] = next_version()
+            dst.execute(insert(table), data[table.name])
+
+        if tombstones:
+            dst.execute(insert(Tombstone.__table__), tombstones)
+        dst.execute(insert(ChangeCounter.__table__).values(owner=owner_id, version=last_version()))
+
+    with src_engine.begin() as src:
+        # Expenses before categories, which they reference
+        for table in reversed(SHARD_TABLES):
+            src.execute(delete(table).where(table.c.owner == owner_id))
+
+    return sum(len(rows) for rows in data.values())
+
+
+def rebalance(from_shards: int):
+    for old_shard in range(from_shards):
+        src_engine = get_shard_engine(old_shard)
+        Base.metadata.create_all(bind=src_engine, tables=SHARD_TABLES)
+
+        with src_engine.connect() as src:
+            owners = set()
+            for table in SHARD_TABLES:
+                owners.update(o for (o,) in src.execute(select(table.c.owner).distinct()) if o is not None)
+
+        for owner_id in sorted(owners):
+            new_shard = shard_for_user(owner_id)
+            if new_shard == old_shard:
+                continue
+            moved = _move_user(owner_id, src_engine, get_shard_engine(new_shard))
+            print(f"user {owner_id}: moved {moved} rows from shard {old_shard} to {new_shard}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    split_cmd = sub.add_parser("split", help="copy user data out of database.db into shards")
+    split_cmd.add_argument("--shards", type=int, required=True)
+    split_cmd.add_argument("--drop-source", action="store_true", help="empty the copied tables in database.db")
+
+    rebalance_cmd = sub.add_parser("rebalance", help="move users after changing the shard count")
+    rebalance_cmd.add_argument("--from-shards", type=int, required=True)
+    rebalance_cmd.add_argument("--shards", type=int, required=True)
+
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    set_settings(Settings.from_env().model_copy(update={"shard_count": args.shards}))
+    migrate()
+
+    if args.command == "split":
+        split(args.drop_source)
+    else:
+        rebalance(args.from_shards)
+
+
+if __name__ == "__main__":
+    main()
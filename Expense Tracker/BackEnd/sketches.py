@@ -0,0 +1,326 @@
+"""
+Streaming cost percentiles per user and category, kept as t-digests in category_stats.
+
+    python sketches.py    # rebuild every user's sketches from their expenses
+
+Expense writes fold each cost into its category's digest, so outlier flags and
+/me/reports/category-stats never scan the expense table. Edited and deleted costs are
+taken back out of the digest: exactly at the tails, where a mistyped cost ends up, and
+approximately in the middle. Those removals are counted as stale, and once they pass
+REBUILD_STALE_FRACTION of the count the category is rebuilt from its expenses by a
+background task after the response. Rebuilds only see expenses still in the table, so
+archived ones drop out of the percentiles then.
+
+migrate() backfills the sketches of categories from before they existed.
+"""
+import argparse
+import math
+import struct
+from collections import defaultdict
+
+from sqlalchemy.orm import Session
+
+from database import Session as DBSession, Person, Expense, Category, CategoryStats, session_for_user
+
+COMPRESSION = 100
+OUTLIER_QUANTILE = 0.99
+# Below this every new maximum would look unusual
+MIN_OUTLIER_SAMPLES = 20
+REBUILD_STALE_FRACTION = 0.25
+
+
+class TDigest:
+    """
+    Merging t-digest: sorted (mean, weight) centroids, kept small near the tails so
+    the high percentiles stay accurate with at most 2 * compression centroids.
+    """
+
+    def __init__(self, compression: int = COMPRESSION, centroids=None,
+                 minimum: float = math.inf, maximum: float = -math.inf):
+        self.compression = compression
+        self.centroids = centroids or []
+        self.min = minimum
+        self.max = maximum
+
+    @property
+    def count(self) -> float:
+        return sum(w for _, w in self.centroids)
+
+    def add(self, value: float, weight: float = 1.0):
+        self.centroids.append((value, weight))
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.centroids) > 2 * self.compression:
+            self.compress()
+
+    def remove(self, value: float, weight: float = 1.0):
+        """
+        Take a value back out, from the centroid nearest to it. The tail centroids hold
+        single values, so removing an extreme value is exact.
+        """
+        if not self.centroids:
+            return
+        index = min(range(len(self.centroids)), key=lambda i: abs(self.centroids[i][0] - value))
+        mean, w = self.centroids[index]
+        if w <= weight:
+            del self.centroids[index]
+        else:
+            self.centroids[index] = (mean, w - weight)
+
+        if not self.centroids:
+            self.min, self.max = math.inf, -math.inf
+            return
+        means = [m for m, _ in self.centroids]
+        if value <= self.min:
+            self.min = min(means)
+        if value >= self.max:
+            self.max = max(means)
+
+    def merge(self, other: "TDigest"):
+        self.centroids.extend(other.centroids)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def _k(self, q: float) -> float:
+        # k1 scale function: centroid size shrinks towards q = 0 and q = 1
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def compress(self):
+        if len(self.centroids) < 2:
+            return
+        centroids = sorted(self.centroids)
+        total = sum(w for _, w in centroids)
+
+        merged = []
+        mean, weight = centroids[0]
+        before = 0.0
+        k_lower = self._k(0.0)
+        for m, w in centroids[1:]:
+            if self._k((before + weight + w) / total) - k_lower <= 1:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                merged.append((mean, weight))
+                before += weight
+                k_lower = self._k(before / total)
+                mean, weight = m, w
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q: float):
+        if not self.centroids:
+            return None
+        centroids = sorted(self.centroids)
+        total = sum(w for _, w in centroids)
+
+        # Interpolate between centroid centres, with min and max as the outer points
+        points = [(0.0, self.min)]
+        before = 0.0
+        for mean, weight in centroids:
+            points.append((before + weight / 2, mean))
+            before += weight
+        points.append((total, self.max))
+
+        target = q * total
+        for (left_rank, left), (right_rank, right) in zip(points, points[1:]):
+            if target <= right_rank:
+                if right_rank == left_rank:
+                    return right
+                return left + (right - left) * (target - left_rank) / (right_rank - left_rank)
+        return self.max
+
+    def to_bytes(self) -> bytes:
+        values = [self.min, self.max] + [x for centroid in self.centroids for x in centroid]
+        return struct.pack(f"<{len(values)}d", *values)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, compression: int = COMPRESSION) -> "TDigest":
+        values = struct.unpack(f"<{len(data) // 8}d", data)
+        centroids = list(zip(values[2::2], values[3::2]))
+        return cls(compression, centroids, values[0], values[1])
+
+
+def _live_costs(db: Session, owner_id: int, category: str):
+    return [
+        cost for (cost,) in
+        db.query(Expense.cost)
+        .join(Category, Expense.category_id == Category.id)
+        .filter(Expense.owner == owner_id, Category.name == category)
+    ]
+
+
+def rebuild_stats(db: Session, owner_id: int, category: str) -> CategoryStats:
+    # Lock the row before reading the costs, so a write in between can't be lost
+    stats = db.query(CategoryStats).filter(
+        CategoryStats.owner == owner_id, CategoryStats.category == category
+    ).with_for_update().first()
+    if stats is None:
+        stats = CategoryStats(owner=owner_id, category=category, digest=TDigest().to_bytes())
+        db.add(stats)
+
+    digest = TDigest()
+    for cost in _live_costs(db, owner_id, category):
+        digest.add(cost)
+    digest.compress()
+
+    stats.count = int(digest.count)
+    stats.stale = 0
+    stats.digest = digest.to_bytes()
+    return stats
+
+
+def needs_rebuild(stats: CategoryStats) -> bool:
+    return stats.stale > stats.count * REBUILD_STALE_FRACTION
+
+
+def _stats_for(db: Session, owner_id: int, category: str) -> CategoryStats:
+    """
+    The category's stats row. Never scans the expenses: migrate() backfills the rows of
+    existing categories, so a missing one belongs to a new category and starts empty.
+    """
+    stats = db.query(CategoryStats).filter(
+        CategoryStats.owner == owner_id, CategoryStats.category == category
+    ).with_for_update().first()
+    if stats is None:
+        stats = CategoryStats(owner=owner_id, category=category, count=0, stale=0, digest=TDigest().to_bytes())
+        db.add(stats)
+    return stats
+
+
+def _is_outlier(digest: TDigest, count: int, cost: float) -> bool:
+    return count >= MIN_OUTLIER_SAMPLES and digest.centroids and cost > digest.quantile(OUTLIER_QUANTILE)
+
+
+def _record(db: Session, owner_id: int, category: str, added=(), removed=()) -> bool:
+    """Update the category's digest. True if the first added cost is unusually large."""
+    stats = _stats_for(db, owner_id, category)
+    digest = TDigest.from_bytes(stats.digest)
+    for cost in removed:
+        digest.remove(cost)
+    count = max(0, stats.count - len(removed))
+    # Judged against the other costs, before this one goes in
+    outlier = bool(added) and _is_outlier(digest, count, added[0])
+    for cost in added:
+        digest.add(cost)
+    stats.digest = digest.to_bytes()
+    stats.count = count + len(added)
+    stats.stale += len(removed)
+    return outlier
+
+
+def observe_cost(db: Session, owner_id: int, category: str, cost: float) -> bool:
+    """A new expense. Returns whether its cost is unusually large for the category."""
+    return _record(db, owner_id, category, [cost])
+
+
+def replace_cost(db: Session, owner_id: int, category: str, old_cost: float, new_cost: float) -> bool:
+    """An expense's cost changed. Returns whether the new cost is unusually large."""
+    return _record(db, owner_id, category, [new_cost], [old_cost])
+
+
+def forget_cost(db: Session, owner_id: int, category: str, cost: float):
+    """An expense was deleted."""
+    _record(db, owner_id, category, removed=[cost])
+
+
+def record_batch(db: Session, owner_id: int, before, after):
+    """
+    Apply a batch of expense changes. before and after map expense id to (category, cost);
+    ids missing from after were deleted.
+    """
+    added = defaultdict(list)
+    removed = defaultdict(list)
+    for expense_id, (category, cost) in before.items():
+        new = after.get(expense_id)
+        if new == (category, cost):
+            continue
+        if category is not None:
+            removed[category].append(cost)
+        if new is not None and new[0] is not None:
+            added[new[0]].append(new[1])
+
+    for category in sorted(set(added) | set(removed)):
+        _record(db, owner_id, category, added.get(category, []), removed.get(category, []))
+
+
+def category_report(db: Session, owner_id: int):
+    report = []
+    for stats in db.query(CategoryStats).filter(CategoryStats.owner == owner_id).order_by(CategoryStats.category):
+        digest = TDigest.from_bytes(stats.digest)
+        if not digest.centroids:
+            continue
+        report.append({
+            "category": stats.category,
+            "count": stats.count,
+            "min": digest.min,
+            "max": digest.max,
+            "p50": digest.quantile(0.5),
+            "p90": digest.quantile(0.9),
+            "p99": digest.quantile(0.99),
+        })
+    return report
+
+
+def rebuild_stale_stats(owner_id: int):
+    """Rebuild the user's stale sketches. A background task, so requests never scan the expenses."""
+    db = session_for_user(owner_id)
+    try:
+        names = [
+            name for (name,) in
+            db.query(CategoryStats.category).filter(
+                CategoryStats.owner == owner_id,
+                CategoryStats.stale > CategoryStats.count * REBUILD_STALE_FRACTION,
+            )
+        ]
+        for name in names:
+            rebuild_stats(db, owner_id, name)
+        db.commit()
+    finally:
+        db.close()
+
+
+def backfill_stats(engine):
+    """Build the sketches of categories that have none yet, e.g. ones from before sketches existed."""
+    db = Session(bind=engine)
+    try:
+        missing = (
+            db.query(Category.owner, Category.name)
+            .outerjoin(CategoryStats, (CategoryStats.owner == Category.owner) & (CategoryStats.category == Category.name))
+            .filter(CategoryStats.id == None, Category.owner != None)
+            .all()
+        )
+        for owner_id, name in missing:
+            rebuild_stats(db, owner_id, name)
+        db.commit()
+    finally:
+        db.close()
+
+
+def rebuild_all():
+    directory = DBSession()
+    try:
+        owner_ids = [person_id for (person_id,) in directory.query(Person.id).filter(Person.disabled == False).all()]
+    finally:
+        directory.close()
+
+    for owner_id in owner_ids:
+        db = session_for_user(owner_id)
+        try:
+            names = [name for (name,) in db.query(Category.name).filter(Category.owner == owner_id).all()]
+            for name in names:
+                rebuild_stats(db, owner_id, name)
+            db.commit()
+        finally:
+            db.close()
+        if names:
+            print(f"user {owner_id}: rebuilt {len(names)} category sketches")
+
+
+def main():
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    rebuild_all()
+
+
+if __name__ == "__main__":
+    main()
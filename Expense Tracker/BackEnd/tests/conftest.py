@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from database import Person
+from settings import Settings, set_settings
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A session on a fresh SQLite database holding users 1 and 2."""
+    set_settings(Settings(
+        database_url=f"sqlite:///{tmp_path / 'test.db'}",
+        archive_dir=str(tmp_path / "archive"),
+    ))
+    database.dispose_engines()
+    database.migrate()
+
+    session = database.Session()
+    for person_id in (1, 2):
+        session.add(Person(
+            id=person_id, username=f"user{person_id}", firstname="Test", lastname="User",
+            gender="x", age=30, password_hash="x",
+        ))
+    session.commit()
+
+    yield session
+
+    session.close()
+    database.dispose_engines()
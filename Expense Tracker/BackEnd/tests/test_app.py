@@ -0,0 +1,90 @@
+import asyncio
+import os
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from database import Person, AccountPurge, dispose_engines
+from purge import request_account_purge, resume_pending_purges
+from settings import Settings, get_settings, set_settings
+
+
+def start_and_stop(app):
+    async def run():
+        async with main.lifespan(app):
+            pass
+    asyncio.run(run())
+
+
+def register(client, username):
+    response = client.post("/register", json={
+        "username": username, "firstname": "Test", "lastname": "User", "gender": "x", "age": 30, "password": "pw",
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def login(client, username):
+    response = client.post("/token", data={"username": username, "password": "pw"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def test_apps_keep_their_own_settings(tmp_path):
+    process_wide = Settings(database_url=f"sqlite:///{tmp_path / 'process.db'}")
+    set_settings(process_wide)
+    first = main.create_app(Settings(database_url=f"sqlite:///{tmp_path / 'first.db'}", secret_key="first"))
+    second = main.create_app(Settings(database_url=f"sqlite:///{tmp_path / 'second.db'}", secret_key="second"))
+
+    with TestClient(first) as a, TestClient(second) as b:
+        register(a, "alice")
+        register(b, "alice")
+        register(b, "bob")
+        a_headers, b_headers = login(a, "alice"), login(b, "bob")
+
+        response = a.post("/expenses", json={"item": "bread", "cost": 3, "category": "food"}, headers=a_headers)
+        assert response.status_code == 200, response.text
+        assert [e["item"] for e in a.get("/me/expenses", headers=a_headers).json()["data"]] == ["bread"]
+        assert b.get("/me/expenses", headers=login(b, "alice")).json()["data"] == []
+        # Tokens are signed with each app's own secret key
+        assert b.get("/me", headers=a_headers).status_code == 401
+        assert a.get("/me", headers=b_headers).status_code == 401
+
+    assert get_settings() is process_wide
+    assert not os.path.exists(tmp_path / "process.db")
+
+
+def test_startup_resumes_interrupted_purges(db):
+    request_account_purge(db, db.get(Person, 1))
+
+    start_and_stop(main.create_app())
+
+    deadline = time.time() + 5
+    while db.get(Person, 1) is not None and time.time() < deadline:
+        time.sleep(0.05)
+        db.expire_all()
+    assert db.get(Person, 1) is None
+    assert db.query(AccountPurge.status).scalar() == "done"
+
+
+def test_startup_without_migrations_leaves_the_database_alone(tmp_path):
+    path = tmp_path / "unmigrated.db"
+    set_settings(Settings(database_url=f"sqlite:///{path}", migrate_on_startup=False))
+
+    try:
+        start_and_stop(main.create_app())
+        time.sleep(0.2)
+        assert not os.path.exists(path)
+    finally:
+        dispose_engines()
+
+
+def test_resuming_purges_on_an_unmigrated_database_is_logged(tmp_path, caplog):
+    set_settings(Settings(database_url=f"sqlite:///{tmp_path / 'unmigrated.db'}"))
+
+    try:
+        assert resume_pending_purges() == []
+        assert "is the database migrated" in caplog.text
+    finally:
+        dispose_engines()
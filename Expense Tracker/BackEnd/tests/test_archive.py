@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, update
+
+import archive
+from archive import (
+    archive_user, archived_count, expense_record, page_with_archive, read_archived, reaches_archive
+)
+from database import Expense, Category
+
+CUTOFF = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def expenses(db):
+    """30 expenses either side of CUTOFF, with date ties; half of them get archived."""
+    category = Category(name="food", owner=1)
+    db.add(category)
+    db.flush()
+    rows = []
+    for i in range(30):
+        # Pairs share a date so the id has to break ties
+        date = CUTOFF + timedelta(days=(i // 2 - 7) * 10)
+        rows.append(Expense(item=f"e{i}", cost=(i * 7) % 11, date=date, owner=1, category_id=category.id))
+    db.add_all(rows)
+    db.add(Expense(item="other user", cost=1, date=CUTOFF - timedelta(days=400), owner=2))
+    db.commit()
+
+    everything = [expense_record(e, "food") for e in rows]
+    archive_user(db, 1, CUTOFF)
+    return everything
+
+
+def page(db, sort, offset, limit, start=None, end=None):
+    live = db.query(Expense).filter(Expense.owner == 1)
+    if start:
+        live = live.filter(Expense.date >= start)
+    if end:
+        live = live.filter(Expense.date <= end)
+    return page_with_archive(
+        db, 1, "expense", live, lambda e: expense_record(e, "food"),
+        reaches_archive(db, 1, start), sort, offset, limit, start, end
+    )
+
+
+def ordered(records, field, descending):
+    return [r["id"] for r in sorted(records, key=lambda r: (r[field], r["id"]), reverse=descending)]
+
+
+@pytest.mark.parametrize("sort,field,descending", [
+    ("date_desc", "date", True),
+    ("date_asc", "date", False),
+    ("cost_desc", "cost", True),
+    ("cost_asc", "cost", False),
+])
+@pytest.mark.parametrize("limit", [1, 4, 7, 15, 16, 100])
+def test_pages_across_the_cutoff_match_one_sorted_list(db, expenses, sort, field, descending, limit):
+    seen = []
+    offset = 0
+    while True:
+        total, records = page(db, sort, offset, limit)
+        assert total == len(expenses)
+        if not records:
+            break
+        seen += [r["id"] for r in records]
+        offset += limit
+
+    assert seen == ordered(expenses, field, descending)
+
+
+def test_rows_moved_out_of_live_table(db, expenses):
+    assert db.query(Expense).filter(Expense.owner == 1, Expense.date < CUTOFF).count() == 0
+    assert len(read_archived(db, 1, "expense")) == 14
+
+
+def test_backdated_live_rows_join_the_archived_tail(db, expenses):
+    backdated = Expense(item="late entry", cost=3, date=CUTOFF - timedelta(days=1000), owner=1)
+    db.add(backdated)
+    db.commit()
+
+    total, records = page(db, "date_asc", 0, 3)
+    assert total == len(expenses) + 1
+    assert records[0]["id"] == backdated.id
+
+
+def test_newest_first_page_skips_the_archive_files(db, expenses, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("archive files read")
+
+    monkeypatch.setattr(archive, "read_archived", fail)
+    total, records = page(db, "date_desc", 0, 10)
+    assert total == len(expenses)
+    assert [r["id"] for r in records] == ordered(expenses, "date", True)[:10]
+
+
+def test_date_filter_counts_partial_days(db, expenses):
+    start = CUTOFF - timedelta(days=50, hours=-12)
+    end = CUTOFF - timedelta(days=10, hours=-6)
+    wanted = [r for r in expenses if start <= r["date"] <= end]
+
+    assert archived_count(db, 1, "expense", start, end) == len(wanted)
+    total, records = page(db, "date_desc", 0, 100, start, end)
+    assert total == len(wanted)
+    assert [r["id"] for r in records] == ordered(wanted, "date", True)
+
+
+def test_archived_ids_are_not_reused(db, expenses):
+    newest_archived = max(r["id"] for r in read_archived(db, 1, "expense"))
+    db.query(Expense).filter(Expense.owner == 1).delete()
+    db.commit()
+
+    fresh = Expense(item="new", cost=1, date=CUTOFF, owner=1)
+    db.add(fresh)
+    db.commit()
+    assert fresh.id > newest_archived
+
+
+def test_crashed_archive_run_is_not_read_twice(db, expenses, monkeypatch):
+    db.add(Expense(item="old", cost=1, date=CUTOFF - timedelta(days=5), owner=1))
+    db.commit()
+    later = CUTOFF + timedelta(days=365)
+
+    def crash():
+        raise RuntimeError("crash before commit")
+
+    monkeypatch.setattr(db, "commit", crash)
+    with pytest.raises(RuntimeError):
+        archive_user(db, 1, CUTOFF)
+    monkeypatch.undo()
+    db.rollback()
+
+    archive_user(db, 1, CUTOFF)
+    ids = [r["id"] for r in read_archived(db, 1, "expense", end=later)]
+    assert len(ids) == len(set(ids)) == 15
+
+
+def test_rows_changed_during_a_run_are_archived_with_their_new_values(db):
+    old = CUTOFF - timedelta(days=30)
+    rows = [Expense(item=f"e{i}", cost=1, date=old, owner=1) for i in range(3)]
+    db.add_all(rows)
+    db.commit()
+    ids = [r.id for r in rows]
+    edited = ids[0]
+
+    def edit_before_the_delete(state):
+        # The API commits an edit between the archive run's read and its delete
+        if state.is_delete and not edits:
+            edits.append(edited)
+            with db.get_bind().begin() as conn:
+                conn.execute(update(Expense).where(Expense.id == edited).values(cost=99, version=Expense.version + 1))
+
+    edits = []
+    event.listen(db, "do_orm_execute", edit_before_the_delete)
+    try:
+        assert archive_user(db, 1, CUTOFF) == 3
+    finally:
+        event.remove(db, "do_orm_execute", edit_before_the_delete)
+
+    archived = {r["id"]: r["cost"] for r in read_archived(db, 1, "expense")}
+    assert archived == {ids[0]: 99, ids[1]: 1, ids[2]: 1}
+    assert archived_count(db, 1, "expense") == 3
+
+
+def test_pages_can_select_just_some_columns(db, expenses):
+    live = db.query(Expense.id, Expense.date, Expense.cost).filter(Expense.owner == 1)
+    total, records = page_with_archive(
+        db, 1, "expense", live, lambda row: row._asdict(), CUTOFF, "cost_desc", 0, 5
+    )
+    assert total == len(expenses)
+    assert [r["id"] for r in records] == ordered(expenses, "cost", True)[:5]
+
+
+def test_cost_sorts_over_a_large_archive_are_refused(db, expenses, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_SORT_LIMIT", len(expenses) - 1)
+    with pytest.raises(ValueError):
+        page(db, "cost_desc", 0, 10)
+    assert page(db, "date_desc", 0, 10)[0] == len(expenses)
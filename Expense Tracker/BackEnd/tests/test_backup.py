@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from backup import check_online_backup, run_backup, verify_snapshot, verify_archive_snapshot, restore_archive_snapshot
+from archive import archive_user, read_archived
+from database import Expense
+from settings import get_settings, set_settings
+
+CUTOFF = datetime(2024, 1, 1)
+
+
+def archived_expenses(db, count):
+    db.add_all(Expense(item=f"e{i}", cost=i, date=CUTOFF - timedelta(days=i + 1), owner=1) for i in range(count))
+    db.commit()
+    archive_user(db, 1, CUTOFF)
+
+
+def test_snapshot_set_includes_the_archive(db, tmp_path):
+    archived_expenses(db, 4)
+
+    report = run_backup(str(tmp_path / "backups"), keep=2)
+
+    [database_file] = report["files"]
+    assert verify_snapshot(database_file["snapshot"])["integrity"] == "ok"
+    archive = report["archive"]
+    assert archive["files"] == 1
+    stamp = os.path.basename(database_file["snapshot"])[len("test-"):-len(".db.gz")]
+    assert os.path.basename(archive["snapshot"]) == f"archive-{stamp}.tar"
+    result = verify_archive_snapshot(archive["snapshot"])
+    assert result["integrity"] == "ok"
+    assert list(result["tables"].values()) == [1]
+
+
+def test_archive_restores_from_its_snapshot(db, tmp_path):
+    archived_expenses(db, 4)
+    report = run_backup(str(tmp_path / "backups"), keep=2)
+
+    # New hardware: the database is restored, the archive directory is gone
+    restored = tmp_path / "restored-archive"
+    restore_archive_snapshot(report["archive"]["snapshot"], str(restored))
+    set_settings(get_settings().model_copy(update={"archive_dir": str(restored)}))
+
+    assert sorted(r["item"] for r in read_archived(db, 1, "expense")) == ["e0", "e1", "e2", "e3"]
+
+
+def test_a_block_cut_off_mid_append_is_ignored(db):
+    archived_expenses(db, 2)
+    [path] = [os.path.join(root, f) for root, _, files in os.walk(get_settings().archive_dir) for f in files]
+    with open(path, "rb") as f:
+        block = f.read()
+    with open(path, "ab") as f:
+        f.write(block[:len(block) // 2])
+
+    assert len(read_archived(db, 1, "expense")) == 2
+
+
+def test_online_backups_need_sqlite_in_wal_mode(db):
+    check_online_backup()
+
+    settings = get_settings()
+    set_settings(settings.model_copy(update={"sqlite_wal": False}))
+    with pytest.raises(ValueError, match="SQLITE_WAL"):
+        check_online_backup()
+
+    set_settings(settings.model_copy(update={"database_url": "postgresql://user:pw@localhost/expenses"}))
+    with pytest.raises(ValueError, match="SQLite"):
+        check_online_backup()
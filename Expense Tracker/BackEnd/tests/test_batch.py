@@ -0,0 +1,104 @@
+from batch import apply_expense_batch, apply_income_batch
+from database import Expense, Category, Income, Tombstone
+from schemas import ExpenseBatchOperation, IncomeBatchOperation
+
+
+def add_expenses(db, owner, count, category="food"):
+    cat = db.query(Category).filter(Category.owner == owner, Category.name == category).first()
+    if cat is None:
+        cat = Category(name=category, owner=owner)
+        db.add(cat)
+        db.flush()
+    expenses = [Expense(item=f"item{i}", cost=10 + i, owner=owner, category_id=cat.id) for i in range(count)]
+    db.add_all(expenses)
+    db.commit()
+    return [e.id for e in expenses]
+
+
+def ops(*specs):
+    return [ExpenseBatchOperation(**spec) for spec in specs]
+
+
+def test_results_keep_request_order_and_statuses(db):
+    mine = add_expenses(db, 1, 3)
+    theirs = add_expenses(db, 2, 1)
+
+    result = apply_expense_batch(db, 1, ops(
+        {"op": "update", "id": mine[0], "cost": 99},
+        {"op": "delete", "id": theirs[0]},
+        {"op": "update", "id": mine[1]},
+        {"op": "delete", "id": 12345},
+        {"op": "recategorize", "id": mine[2]},
+    ))
+
+    assert [(r.id, r.status) for r in result["results"]] == [
+        (mine[0], "ok"),
+        (theirs[0], "not_found"),
+        (mine[1], "invalid"),
+        (12345, "not_found"),
+        (mine[2], "invalid"),
+    ]
+    assert result["applied"] == 1
+
+
+def test_other_users_rows_are_untouched(db):
+    theirs = add_expenses(db, 2, 2)
+
+    apply_expense_batch(db, 1, ops(
+        {"op": "update", "id": theirs[0], "cost": 1},
+        {"op": "delete", "id": theirs[1]},
+    ))
+
+    db.expire_all()
+    costs = sorted(cost for (cost,) in db.query(Expense.cost).filter(Expense.owner == 2))
+    assert costs == [10, 11]
+
+
+def test_duplicate_ids_are_rejected(db):
+    mine = add_expenses(db, 1, 1)
+
+    result = apply_expense_batch(db, 1, ops(
+        {"op": "update", "id": mine[0], "cost": 50},
+        {"op": "delete", "id": mine[0]},
+    ))
+
+    assert [r.status for r in result["results"]] == ["ok", "invalid"]
+    db.expire_all()
+    assert db.query(Expense).filter(Expense.id == mine[0]).one().cost == 50
+
+
+def test_updates_moves_and_deletes_share_one_version(db):
+    mine = add_expenses(db, 1, 3)
+
+    apply_expense_batch(db, 1, ops(
+        {"op": "update", "id": mine[0], "item": "renamed"},
+        {"op": "recategorize", "id": mine[1], "category": "rent"},
+        {"op": "delete", "id": mine[2]},
+    ))
+
+    db.expire_all()
+    first = db.query(Expense).filter(Expense.id == mine[0]).one()
+    moved = db.query(Expense).filter(Expense.id == mine[1]).one()
+    tombstone = db.query(Tombstone).filter(Tombstone.row_id == mine[2]).one()
+    rent = db.query(Category).filter(Category.owner == 1, Category.name == "rent").one()
+
+    assert first.item == "renamed"
+    assert moved.category_id == rent.id
+    assert db.query(Expense).filter(Expense.id == mine[2]).first() is None
+    assert first.version == moved.version == tombstone.version == rent.version > 1
+
+
+def test_income_batch(db):
+    income = [Income(amount=100, source="job", owner=1), Income(amount=5, source="gift", owner=2)]
+    db.add_all(income)
+    db.commit()
+
+    result = apply_income_batch(db, 1, [
+        IncomeBatchOperation(op="update", id=income[0].id, amount=120),
+        IncomeBatchOperation(op="delete", id=income[1].id),
+    ])
+
+    assert [r.status for r in result["results"]] == ["ok", "not_found"]
+    db.expire_all()
+    assert db.query(Income.amount).filter(Income.id == income[0].id).scalar() == 120
+    assert db.query(Income).filter(Income.id == income[1].id).count() == 1
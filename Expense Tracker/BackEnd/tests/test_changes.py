@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from batch import apply_expense_batch
+from changes import get_changes, next_version, record_deletes
+from database import Expense, Category, Income, Tombstone
+from schemas import ExpenseBatchOperation
+
+
+def add_expenses(db, owner, costs):
+    """One change per call: the category and expenses share a version."""
+    version = next_version(db, owner)
+    category = db.query(Category).filter(Category.owner == owner, Category.name == "food").first()
+    if category is None:
+        category = Category(name="food", owner=owner, version=version)
+        db.add(category)
+        db.flush()
+    expenses = [Expense(item="x", cost=cost, owner=owner, category_id=category.id, version=version) for cost in costs]
+    db.add_all(expenses)
+    db.commit()
+    return [e.id for e in expenses]
+
+
+def sync(db, owner, since=0, limit=1000):
+    pages = []
+    while True:
+        page = get_changes(db, owner, since, limit)
+        pages.append(page)
+        since = page["version"]
+        if not page["has_more"]:
+            return pages
+
+
+def test_first_sync_returns_everything(db):
+    ids = add_expenses(db, 1, [1, 2, 3])
+    add_expenses(db, 2, [4])
+
+    changes = get_changes(db, 1, 0)
+    assert sorted(e["id"] for e in changes["expenses"]) == ids
+    assert {e["category"] for e in changes["expenses"]} == {"food"}
+    assert [c["name"] for c in changes["categories"]] == ["food"]
+    assert not changes["has_more"]
+    assert changes["archived_before"] is None
+
+
+def test_sync_from_a_version_returns_only_later_changes(db):
+    add_expenses(db, 1, [1])
+    version = get_changes(db, 1, 0)["version"]
+    later = add_expenses(db, 1, [2])
+
+    changes = get_changes(db, 1, version)
+    assert [e["id"] for e in changes["expenses"]] == later
+    assert changes["categories"] == []
+    assert get_changes(db, 1, changes["version"])["expenses"] == []
+
+
+def test_deletes_come_back_as_tombstones(db):
+    ids = add_expenses(db, 1, [1, 2])
+    version = get_changes(db, 1, 0)["version"]
+
+    record_deletes(db, 1, "expense", [ids[0]], next_version(db, 1))
+    db.query(Expense).filter(Expense.id == ids[0]).delete()
+    db.commit()
+
+    changes = get_changes(db, 1, version)
+    assert changes["expenses"] == []
+    assert [(d["kind"], d["id"]) for d in changes["deleted"]] == [("expense", ids[0])]
+
+
+def test_a_batch_is_one_version(db):
+    ids = add_expenses(db, 1, [1, 2, 3])
+    version = get_changes(db, 1, 0)["version"]
+
+    apply_expense_batch(db, 1, [
+        ExpenseBatchOperation(op="update", id=ids[0], cost=10),
+        ExpenseBatchOperation(op="recategorize", id=ids[1], category="rent"),
+        ExpenseBatchOperation(op="delete", id=ids[2]),
+    ])
+
+    changes = get_changes(db, 1, version)
+    versions = {e["version"] for e in changes["expenses"]} | {d["version"] for d in changes["deleted"]}
+    versions |= {c["version"] for c in changes["categories"]}
+    assert versions == {changes["version"]}
+    assert changes["version"] == version + 1
+
+
+def test_pages_never_split_a_version(db):
+    for size in (3, 1, 4, 1, 5):
+        add_expenses(db, 1, range(size))
+    record_deletes(db, 1, "expense", [999], next_version(db, 1))
+    db.commit()
+
+    full = get_changes(db, 1, 0)
+    pages = sync(db, 1, limit=2)
+
+    assert len(pages) > 1
+    assert all(p["has_more"] for p in pages[:-1])
+    assert pages[-1]["version"] == full["version"]
+    seen = {}
+    for page in pages:
+        for e in page["expenses"]:
+            assert seen.setdefault(e["version"], page["version"]) == page["version"]
+    assert sorted(e["id"] for p in pages for e in p["expenses"]) == sorted(e["id"] for e in full["expenses"])
+    assert [d["id"] for p in pages for d in p["deleted"]] == [999]
+
+
+def test_tombstones_of_reused_ids_are_left_out(db):
+    ids = add_expenses(db, 1, [1])
+    # After a shard move the old id may belong to a moved row again
+    record_deletes(db, 1, "expense", [ids[0], 12345], next_version(db, 1))
+    db.commit()
+
+    changes = get_changes(db, 1, 0)
+    assert [e["id"] for e in changes["expenses"]] == ids
+    assert [d["id"] for d in changes["deleted"]] == [12345]
+
+
+def test_income_and_other_users_are_separate(db):
+    db.add(Income(amount=5, source="job", owner=1, date=datetime(2024, 1, 1), version=next_version(db, 1)))
+    db.commit()
+    add_expenses(db, 2, [1])
+
+    changes = get_changes(db, 1, 0)
+    assert [i.source for i in changes["income"]] == ["job"]
+    assert changes["expenses"] == []
+    assert db.query(Tombstone).count() == 0
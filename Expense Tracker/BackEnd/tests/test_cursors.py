@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from database import Expense, Category
+from utils import (
+    EXPENSE_COLUMNS, decode_cursor, encode_cursor, cursor_offset, keyset_page, parse_fields, select_fields
+)
+
+
+@pytest.fixture
+def expenses(db):
+    category = Category(name="food", owner=1)
+    db.add(category)
+    db.flush()
+    start = datetime(2025, 1, 1)
+    # Three rows per date and repeated costs, so the id has to break ties
+    db.add_all(
+        Expense(item=f"e{i}", cost=i % 4, date=start + timedelta(days=i // 3), owner=1, category_id=category.id)
+        for i in range(25)
+    )
+    db.add(Expense(item="other user", cost=1, date=start, owner=2))
+    db.commit()
+    return db.query(Expense).filter(Expense.owner == 1).all()
+
+
+def test_cursor_round_trip():
+    data = {"k": ["2025-01-01T10:00:00", 42]}
+    cursor = encode_cursor(data)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == data
+    assert decode_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor({"x": 1}), "W10"])
+def test_bad_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_cursor_kinds_are_not_mixed():
+    with pytest.raises(HTTPException):
+        cursor_offset({"k": [1, 2]})
+    assert cursor_offset({"o": 40}) == 40
+
+
+@pytest.mark.parametrize("sort_column,descending", [
+    (Expense.date, True),
+    (Expense.date, False),
+    (Expense.cost, True),
+    (Expense.cost, False),
+])
+@pytest.mark.parametrize("limit", [1, 3, 7, 25, 30])
+def test_cursor_walk_matches_full_order(db, expenses, sort_column, descending, limit):
+    key = lambda e: (getattr(e, sort_column.key), e.id)
+    expected = [e.id for e in sorted(expenses, key=key, reverse=descending)]
+
+    wanted = ["id", "cost"]
+    query = select_fields(db, EXPENSE_COLUMNS, wanted, Expense.id, sort_column).filter(Expense.owner == 1)
+    seen = []
+    cursor = None
+    while True:
+        rows, next_cursor = keyset_page(query, sort_column, Expense.id, descending, decode_cursor(cursor), 0, limit)
+        seen += [row.id for row in rows]
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+
+    assert seen == expected
+
+
+def test_offset_without_cursor(db, expenses):
+    query = select_fields(db, EXPENSE_COLUMNS, ["id"], Expense.id, Expense.date).filter(Expense.owner == 1)
+    first, cursor = keyset_page(query, Expense.date, Expense.id, True, None, 0, 5)
+    second, _ = keyset_page(query, Expense.date, Expense.id, True, None, 5, 5)
+    after_cursor, _ = keyset_page(query, Expense.date, Expense.id, True, decode_cursor(cursor), 0, 5)
+    assert [r.id for r in second] == [r.id for r in after_cursor]
+    assert not {r.id for r in first} & {r.id for r in second}
+
+
+def test_parse_fields():
+    assert parse_fields(None, EXPENSE_COLUMNS) == list(EXPENSE_COLUMNS)
+    assert parse_fields(" id, cost ", EXPENSE_COLUMNS) == ["id", "cost"]
+    with pytest.raises(HTTPException):
+        parse_fields("id,password", EXPENSE_COLUMNS)
@@ -0,0 +1,142 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+import database
+from database import Person, Expense, Category, AccountPurge
+from purge import request_account_purge, purge_account, _claim, PURGE_STAGES, PURGE_STALE_AFTER
+
+
+def add_expenses(db, owner, count):
+    category = Category(name="food", owner=owner)
+    db.add(category)
+    db.flush()
+    db.add_all(Expense(item=f"item{i}", cost=i, owner=owner, category_id=category.id) for i in range(count))
+    db.commit()
+
+
+def new_person(db, username):
+    person = Person(username=username, firstname="Test", lastname="User", gender="x", age=30, password_hash="x")
+    db.add(person)
+    db.commit()
+    return person
+
+
+def test_purge_deletes_everything_in_chunks(db):
+    add_expenses(db, 1, 7)
+    add_expenses(db, 2, 3)
+    request_account_purge(db, db.get(Person, 1))
+
+    purge_account(1, chunk_size=2, pause=0)
+
+    db.expire_all()
+    purge = db.query(AccountPurge).filter(AccountPurge.person_id == 1).one()
+    assert (purge.status, purge.stage, purge.rows_deleted) == ("done", "person", 8)
+    assert db.get(Person, 1) is None
+    assert db.query(Expense).filter(Expense.owner == 1).count() == 0
+    assert db.query(Expense).filter(Expense.owner == 2).count() == 3
+
+
+def test_only_one_worker_claims_a_purge(db):
+    request_account_purge(db, db.get(Person, 1))
+
+    assert _claim(db, 1)
+    assert not _claim(db, 1)
+
+    # A running purge whose worker stopped sending heartbeats is taken over
+    db.query(AccountPurge).update({AccountPurge.heartbeat_at: datetime.now() - 2 * PURGE_STALE_AFTER})
+    db.commit()
+    assert _claim(db, 1)
+
+
+def test_people_get_new_ids_after_a_purge(db):
+    request_account_purge(db, db.get(Person, 2))
+    purge_account(2, pause=0)
+
+    assert new_person(db, "second").id == 3
+
+
+def test_a_finished_purge_row_is_started_over(db):
+    request_account_purge(db, db.get(Person, 1))
+    purge_account(1, pause=0)
+
+    # An id freed before person had AUTOINCREMENT, given to someone else
+    db.add(Person(id=1, username="second", firstname="Test", lastname="User", gender="x", age=30, password_hash="x"))
+    db.commit()
+    add_expenses(db, 1, 2)
+
+    purge = request_account_purge(db, db.get(Person, 1))
+    assert (purge.status, purge.stage, purge.rows_deleted, purge.finished_at) == ("pending", PURGE_STAGES[0][0], 0, None)
+
+    purge_account(1, pause=0)
+    db.expire_all()
+    assert db.get(Person, 1) is None
+    assert db.query(Expense).filter(Expense.owner == 1).count() == 0
+
+
+def test_migrate_adds_autoincrement_to_person(tmp_path):
+    url = f"sqlite:///{tmp_path / 'old.db'}"
+    old = create_engine(url)
+    with old.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE person (id INTEGER PRIMARY KEY, username VARCHAR UNIQUE NOT NULL, "
+            "firstname VARCHAR NOT NULL, lastname VARCHAR NOT NULL, gender VARCHAR NOT NULL, age INTEGER NOT NULL, "
+            "profile_emoji VARCHAR, password_hash VARCHAR NOT NULL, created_at DATETIME)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE category (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+            "owner INTEGER REFERENCES person (id))"
+        ))
+        conn.execute(text("INSERT INTO person (id, username, firstname, lastname, gender, age, password_hash) "
+                          "VALUES (1, 'kept', 'a', 'b', 'x', 30, 'x')"))
+        conn.execute(text("CREATE TABLE account_purge (id INTEGER PRIMARY KEY, person_id INTEGER UNIQUE NOT NULL, "
+                          "stage VARCHAR(20) NOT NULL, rows_deleted INTEGER NOT NULL, status VARCHAR(20) NOT NULL, "
+                          "requested_at DATETIME, finished_at DATETIME)"))
+        conn.execute(text("INSERT INTO account_purge (person_id, stage, rows_deleted, status) "
+                          "VALUES (5, 'person', 0, 'done')"))
+    old.dispose()
+
+    from settings import Settings, set_settings
+    set_settings(Settings(database_url=url, archive_dir=str(tmp_path / "archive")))
+    database.dispose_engines()
+    try:
+        database.migrate()
+        db = database.Session()
+        assert db.get(Person, 1).username == "kept"
+        assert new_person(db, "new").id == 6
+        # Other tables still point at person, not at a leftover copy
+        schema = db.execute(text("SELECT sql FROM sqlite_master WHERE name = 'category'")).scalar()
+        assert "person_" not in schema
+        db.close()
+    finally:
+        database.dispose_engines()
+
+
+def test_migrate_keeps_foreign_keys_of_rebuilt_tables(tmp_path):
+    url = f"sqlite:///{tmp_path / 'old.db'}"
+    old = create_engine(url)
+    with old.begin() as conn:
+        conn.execute(text("CREATE TABLE person (id INTEGER PRIMARY KEY, username VARCHAR UNIQUE NOT NULL, "
+                          "firstname VARCHAR NOT NULL, lastname VARCHAR NOT NULL, gender VARCHAR NOT NULL, "
+                          "age INTEGER NOT NULL, profile_emoji VARCHAR, password_hash VARCHAR NOT NULL, "
+                          "created_at DATETIME)"))
+        conn.execute(text("CREATE TABLE income (id INTEGER PRIMARY KEY, amount FLOAT NOT NULL, "
+                          "source VARCHAR(100) NOT NULL, date DATETIME, owner INTEGER NOT NULL REFERENCES person (id))"))
+        conn.execute(text("CREATE INDEX ix_income_id ON income (id)"))
+        conn.execute(text("INSERT INTO income (id, amount, source, owner) VALUES (4, 10, 'job', 1)"))
+    old.dispose()
+
+    from settings import Settings, set_settings
+    set_settings(Settings(database_url=url, archive_dir=str(tmp_path / "archive")))
+    database.dispose_engines()
+    try:
+        database.migrate()
+        with database.get_engine().connect() as conn:
+            schema = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'income'")).scalar()
+            indexes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                            "AND tbl_name = 'income' AND sql IS NOT NULL")).scalars())
+            assert conn.execute(text("SELECT id FROM income")).scalar() == 4
+        assert "AUTOINCREMENT" in schema and "REFERENCES person" in schema
+        assert indexes == {"ix_income_id", "ix_income_owner_version"}
+    finally:
+        database.dispose_engines()
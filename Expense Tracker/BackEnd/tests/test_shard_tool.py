@@ -0,0 +1,100 @@
+import pytest
+from sqlalchemy import create_engine, func, text
+
+import database
+from database import Person, Category, Expense, CategoryStats
+from settings import Settings, set_settings
+from shard_tool import split
+
+
+@pytest.fixture
+def source(tmp_path):
+    """database.db with two users' expenses, before sharding was turned on."""
+    settings = Settings(
+        database_url=f"sqlite:///{tmp_path / 'database.db'}",
+        shard_url_template=f"sqlite:///{tmp_path / 'shard_{n}.db'}",
+        archive_dir=str(tmp_path / "archive"),
+    )
+    set_settings(settings)
+    database.dispose_engines()
+    database.migrate()
+
+    db = database.Session()
+    for person_id in (1, 2):
+        db.add(Person(id=person_id, username=f"user{person_id}", firstname="Test", lastname="User",
+                      gender="x", age=30, password_hash="x"))
+        category = Category(name="food", owner=person_id)
+        db.add(category)
+        db.flush()
+        db.add_all(Expense(item=f"item{i}", cost=i, owner=person_id, category_id=category.id) for i in range(5))
+    db.commit()
+    db.close()
+
+    set_settings(settings.model_copy(update={"shard_count": 2}))
+    database.dispose_engines()
+    database.migrate()
+    yield
+    database.dispose_engines()
+
+
+def shard_rows(shard, model):
+    db = database.session_for_shard(shard)
+    try:
+        return db.query(model.owner, func.count(model.id)).group_by(model.owner).all()
+    finally:
+        db.close()
+
+
+def test_split_moves_each_user_to_their_shard(source):
+    split(drop_source=False)
+
+    assert shard_rows(0, Expense) == [(2, 5)]
+    assert shard_rows(1, Expense) == [(1, 5)]
+
+
+def test_split_can_run_again(source):
+    split(drop_source=False)
+    split(drop_source=False)
+
+    assert shard_rows(0, Expense) == [(2, 5)]
+    assert shard_rows(1, Category) == [(1, 1)]
+
+
+def test_split_upgrades_an_old_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'database.db'}"
+    old = create_engine(url)
+    with old.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE person (id INTEGER PRIMARY KEY, username VARCHAR UNIQUE NOT NULL, "
+            "firstname VARCHAR NOT NULL, lastname VARCHAR NOT NULL, gender VARCHAR NOT NULL, age INTEGER NOT NULL, "
+            "profile_emoji VARCHAR, password_hash VARCHAR NOT NULL, created_at DATETIME)"
+        ))
+        conn.execute(text("CREATE TABLE category (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+                          "owner INTEGER REFERENCES person (id))"))
+        conn.execute(text("CREATE TABLE expense (id INTEGER PRIMARY KEY, item VARCHAR NOT NULL, cost FLOAT NOT NULL, "
+                          "date DATETIME, owner INTEGER REFERENCES person (id), "
+                          "category_id INTEGER REFERENCES category (id))"))
+        conn.execute(text("INSERT INTO person (id, username, firstname, lastname, gender, age, password_hash) "
+                          "VALUES (1, 'old', 'a', 'b', 'x', 30, 'x')"))
+        conn.execute(text("INSERT INTO category (id, name, owner) VALUES (1, 'food', 1)"))
+        conn.execute(text("INSERT INTO expense (id, item, cost, owner, category_id) VALUES (1, 'bread', 3, 1, 1)"))
+    old.dispose()
+
+    set_settings(Settings(
+        database_url=url,
+        shard_url_template=f"sqlite:///{tmp_path / 'shard_{n}.db'}",
+        archive_dir=str(tmp_path / "archive"),
+        shard_count=2,
+    ))
+    database.dispose_engines()
+    try:
+        database.migrate()
+        split(drop_source=False)
+
+        assert shard_rows(1, Expense) == [(1, 1)]
+        db = database.session_for_shard(1)
+        assert db.query(Expense.version).scalar() == 1
+        assert db.query(CategoryStats.count).filter(CategoryStats.owner == 1).scalar() == 1
+        db.close()
+    finally:
+        database.dispose_engines()
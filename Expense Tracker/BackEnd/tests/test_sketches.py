@@ -0,0 +1,243 @@
+import bisect
+import random
+
+import pytest
+
+import database
+from database import Expense, Category, CategoryStats
+from sketches import (
+    COMPRESSION, MIN_OUTLIER_SAMPLES, TDigest, category_report, forget_cost, observe_cost, record_batch,
+    rebuild_stale_stats, replace_cost,
+)
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@pytest.mark.parametrize("q", [0.01, 0.1, 0.5, 0.9, 0.99])
+def test_quantiles_of_a_known_sequence(q):
+    digest = TDigest()
+    values = list(range(1, 10001))
+    random.Random(1).shuffle(values)
+    for value in values:
+        digest.add(value)
+
+    # Within 0.5% of the range of the exact answer
+    assert digest.quantile(q) == pytest.approx(q * 10000, abs=50)
+
+
+def test_tail_quantiles_of_a_skewed_distribution():
+    rng = random.Random(2)
+    values = [rng.lognormvariate(3, 1) for _ in range(20000)]
+    digest = TDigest()
+    for value in values:
+        digest.add(value)
+
+    # t-digest bounds the rank error, which on a long tail allows a larger value error
+    ordered = sorted(values)
+    for q in (0.5, 0.9, 0.99, 0.999):
+        rank = bisect.bisect(ordered, digest.quantile(q)) / len(ordered)
+        assert rank == pytest.approx(q, abs=0.005)
+    assert digest.quantile(0.5) == pytest.approx(exact_quantile(values, 0.5), rel=0.01)
+    assert digest.quantile(0) == min(values)
+    assert digest.quantile(1) == max(values)
+
+
+def test_size_stays_bounded():
+    digest = TDigest()
+    for value in range(100000):
+        digest.add(value)
+    assert len(digest.centroids) <= 2 * COMPRESSION
+    digest.compress()
+    assert len(digest.centroids) <= COMPRESSION
+    assert digest.count == 100000
+
+
+def test_small_digests_are_exact():
+    digest = TDigest()
+    assert digest.quantile(0.5) is None
+    digest.add(7)
+    assert digest.quantile(0.99) == 7
+    for value in (1, 2, 3):
+        digest.add(value)
+    digest.compress()
+    assert sorted(mean for mean, _ in digest.centroids) == [1, 2, 3, 7]
+
+
+def test_bytes_round_trip():
+    digest = TDigest()
+    for value in (3.5, 1.25, 99.0, 42.0):
+        digest.add(value)
+    copy = TDigest.from_bytes(digest.to_bytes())
+    assert copy.centroids == digest.centroids
+    assert (copy.min, copy.max) == (digest.min, digest.max)
+
+
+def test_merge_matches_a_single_digest():
+    rng = random.Random(3)
+    values = [rng.uniform(0, 100) for _ in range(10000)]
+    whole, left, right = TDigest(), TDigest(), TDigest()
+    for value in values:
+        whole.add(value)
+    for value in values[:5000]:
+        left.add(value)
+    for value in values[5000:]:
+        right.add(value)
+
+    left.merge(right)
+    assert left.count == whole.count
+    for q in (0.5, 0.9, 0.99):
+        assert left.quantile(q) == pytest.approx(whole.quantile(q), abs=1)
+
+
+def add_expense(db, category, cost, owner=1):
+    cat = db.query(Category).filter(Category.owner == owner, Category.name == category).first()
+    if cat is None:
+        cat = Category(name=category, owner=owner)
+        db.add(cat)
+        db.flush()
+    outlier = observe_cost(db, owner, category, cost)
+    expense = Expense(item="x", cost=cost, owner=owner, category_id=cat.id)
+    db.add(expense)
+    db.commit()
+    return expense, outlier
+
+
+def stats_row(db, category):
+    db.expire_all()
+    return db.query(CategoryStats).filter(CategoryStats.owner == 1, CategoryStats.category == category).one()
+
+
+def test_outliers_need_enough_history(db):
+    flags = [add_expense(db, "food", cost)[1] for cost in [10] * (MIN_OUTLIER_SAMPLES - 1) + [500]]
+    assert not any(flags)
+
+    for cost in range(5, 15):
+        add_expense(db, "food", cost)
+    assert add_expense(db, "food", 1000)[1]
+    assert not add_expense(db, "food", 9)[1]
+
+
+def add_legacy_expenses(db, category, costs):
+    """Expenses written before category_stats existed."""
+    cat = Category(name=category, owner=1)
+    db.add(cat)
+    db.flush()
+    db.add_all(Expense(item="x", cost=cost, owner=1, category_id=cat.id) for cost in costs)
+    db.commit()
+
+
+def test_migrate_backfills_existing_categories(db):
+    add_legacy_expenses(db, "rent", [900 + i for i in range(30)])
+
+    database.migrate()
+
+    rent = stats_row(db, "rent")
+    assert (rent.count, rent.stale) == (30, 0)
+    _, outlier = add_expense(db, "rent", 5000)
+    assert outlier
+
+
+def test_writes_never_scan_the_expenses(db):
+    add_legacy_expenses(db, "rent", [900 + i for i in range(30)])
+
+    # Not backfilled: the write starts an empty sketch instead of reading the 30 expenses
+    add_expense(db, "rent", 5000)
+    assert stats_row(db, "rent").count == 1
+
+
+def test_batch_changes_leave_the_digests(db):
+    expenses = [add_expense(db, "food", cost)[0] for cost in (10, 20, 30, 40)]
+    before = {e.id: ("food", e.cost) for e in expenses}
+    after = {
+        expenses[0].id: ("food", 10),      # unchanged
+        expenses[1].id: ("food", 25),      # new cost
+        expenses[2].id: ("travel", 30),    # moved
+        # expenses[3] deleted
+    }
+
+    record_batch(db, 1, before, after)
+    db.commit()
+
+    food = stats_row(db, "food")
+    travel = stats_row(db, "travel")
+    assert (food.count, food.stale) == (2, 3)
+    assert sorted(mean for mean, _ in TDigest.from_bytes(food.digest).centroids) == [10, 25]
+    assert (travel.count, travel.stale) == (1, 0)
+
+
+def test_a_deleted_typo_stops_skewing_the_category(db):
+    for cost in range(100):
+        add_expense(db, "food", 10 + cost % 10)
+    typo, _ = add_expense(db, "food", 1e9)
+
+    forget_cost(db, 1, "food", typo.cost)
+    db.delete(typo)
+    db.commit()
+
+    food = category_report(db, 1)[0]
+    assert (food["count"], food["max"]) == (100, 19)
+    assert food["p99"] <= 19
+    assert add_expense(db, "food", 25)[1]
+
+
+def test_a_corrected_cost_replaces_the_old_one(db):
+    for cost in range(100):
+        add_expense(db, "food", 10 + cost % 10)
+    typo, _ = add_expense(db, "food", 1e9)
+
+    assert not replace_cost(db, 1, "food", typo.cost, 15)
+    typo.cost = 15
+    db.commit()
+
+    food = category_report(db, 1)[0]
+    assert (food["count"], food["max"]) == (101, 19)
+
+
+def test_stale_sketches_are_rebuilt_in_the_background(db):
+    expenses = [add_expense(db, "food", cost)[0] for cost in (10, 20, 30, 40)]
+    for expense in expenses[:2]:
+        forget_cost(db, 1, "food", expense.cost)
+        db.delete(expense)
+        db.commit()
+    assert stats_row(db, "food").stale == 2
+
+    add_expense(db, "food", 50)
+    assert stats_row(db, "food").stale == 2
+
+    rebuild_stale_stats(1)
+    food = stats_row(db, "food")
+    assert (food.count, food.stale) == (3, 0)
+    assert TDigest.from_bytes(food.digest).min == 30
+
+
+def test_removing_tail_values_is_exact():
+    digest = TDigest()
+    for value in range(1000):
+        digest.add(value)
+    digest.add(10**6)
+    digest.add(-500)
+    digest.compress()
+
+    digest.remove(10**6)
+    digest.remove(-500)
+    assert (digest.min, digest.max) == (0, 999)
+    assert digest.count == 1000
+    assert digest.quantile(0.99) == pytest.approx(990, abs=5)
+
+
+def test_report_reads_only_the_sketches(db):
+    for cost in range(1, 101):
+        add_expense(db, "food", cost)
+    add_expense(db, "taxi", 12, owner=2)
+
+    report = category_report(db, 1)
+    assert [r["category"] for r in report] == ["food"]
+    food = report[0]
+    assert food["count"] == 100
+    assert (food["min"], food["max"]) == (1, 100)
+    assert food["p50"] == pytest.approx(50, abs=2)
+    assert food["p90"] == pytest.approx(90, abs=2)
+    assert food["p99"] == pytest.approx(99, abs=2)
@@ -1,17 +1,126 @@
+import base64
+import binascii
+import json
 from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database import Expense, Income
+from sqlalchemy import func, and_, or_, DateTime
+from database import Expense, Income, Category, Budget
+from archive import archived_total
+
+# Columns each list endpoint can return, for the fields= parameter
+EXPENSE_COLUMNS = {
+    "id": Expense.id,
+    "item": Expense.item,
+    "cost": Expense.cost,
+    "date": Expense.date,
+    "category": Category.name.label("category"),
+}
+INCOME_COLUMNS = {"id": Income.id, "amount": Income.amount, "source": Income.source, "date": Income.date}
+BUDGET_COLUMNS = {
+    "id": Budget.id,
+    "category": Budget.category,
+    "limit": Budget.limit,
+    "period": Budget.period,
+    "start_date": Budget.start_date,
+    "end_date": Budget.end_date,
+}
+CATEGORY_COLUMNS = {"id": Category.id, "name": Category.name}
 
 
 def get_sort_options(sort: str):
+    """Sort column and whether it is descending."""
     options = {
-        "date_desc": Expense.date.desc(),
-        "date_asc": Expense.date.asc(),
-        "cost_desc": Expense.cost.desc(),
-        "cost_asc": Expense.cost.asc()
+        "date_desc": (Expense.date, True),
+        "date_asc": (Expense.date, False),
+        "cost_desc": (Expense.cost, True),
+        "cost_asc": (Expense.cost, False)
     }
-    return options.get(sort, Expense.date.desc())
+    return options.get(sort, (Expense.date, True))
+
+
+def parse_fields(fields: Optional[str], allowed: dict) -> list:
+    """Requested field names, or every allowed field when none are given."""
+    if not fields:
+        return list(allowed)
+    wanted = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in wanted if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return wanted
+
+
+def select_fields(db: Session, columns: dict, wanted: list, *always):
+    """Query only the wanted columns, plus any the caller needs for sorting and cursors."""
+    selected = [columns[f] for f in wanted]
+    extra = [c for c in always if c.key not in wanted]
+    return db.query(*selected, *extra)
+
+
+def encode_cursor(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[dict]:
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii") + b"=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(data, dict) or not ("k" in data or "o" in data):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return data
+
+
+def cursor_offset(cursor: Optional[dict]) -> int:
+    """Offset from a cursor made by an in-memory page (archive fallthrough)."""
+    if cursor is None:
+        return 0
+    if "o" not in cursor:
+        raise HTTPException(status_code=400, detail="Cursor no longer valid, start again without one")
+    return int(cursor["o"])
+
+
+def keyset_page(query, sort_column, id_column, descending: bool, cursor: Optional[dict], offset: int, limit: Optional[int]):
+    """
+    One page ordered by (sort_column, id), returning (rows, next_cursor).
+
+    With a cursor the page starts right after the row it points at, so deep pages
+    cost the same as the first one; without one the plain offset is used.
+    """
+    if cursor is not None:
+        if "k" not in cursor:
+            raise HTTPException(status_code=400, detail="Cursor no longer valid, start again without one")
+        value, last_id = cursor["k"]
+        if isinstance(sort_column.type, DateTime) and value is not None:
+            value = datetime.fromisoformat(value)
+        if descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < last_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > last_id)))
+        offset = 0
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    if offset:
+        query = query.offset(offset)
+    if limit is None:
+        return query.all(), None
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    value = getattr(rows[-1], sort_column.key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return rows, encode_cursor({"k": [value, getattr(rows[-1], id_column.key)]})
 
 
 def get_financial_summary(db: Session, owner_id: int, days: int = 30):
@@ -42,6 +151,10 @@ def get_financial_summary(db: Session, owner_id: int, days: int = 30):
         or 0
     )
 
+    # Anything older than the user's archive cutoff is counted from the rollups
+    total_expenses += archived_total(db, owner_id, "expense", start_date, end_date)
+    total_income += archived_total(db, owner_id, "income", start_date, end_date)
+
     return {
         "days": days,
         "total_income": float(total_income),